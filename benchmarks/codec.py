@@ -0,0 +1,64 @@
+""" Кодек шагов (interface/codec.py) против to_dict + json + get_step_data.
+    Проверяет, что декодированные шаги совпадают с исходными, и меряет
+    кодирование / декодирование плана в секунду и размер.
+
+    python -m benchmarks.codec --steps 20 --rounds 2000
+"""
+import argparse
+import copy
+import json
+import time
+from typing import Callable
+
+from benchmarks.conveyor import step_types
+from interface.codec import decode_steps, encode_steps, use_msgpack
+from interface.steps_datatype import get_step_data
+from interface.storage import json_default
+
+
+def make_plan(length: int) -> list:
+    types = list(step_types.values())
+    return [types[i % len(types)][0](f'step_{i}', i) for i in range(length)]
+
+def old_encode(steps: list) -> bytes:
+    return json.dumps([step.to_dict() for step in steps], ensure_ascii=False,
+                      default=json_default).encode('utf-8')
+
+def old_decode(raw: bytes) -> list:
+    # Как compile_step до кодека
+    return [get_step_data(**copy.deepcopy(step)) for step in json.loads(raw)]
+
+def rate(func: Callable, arg, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    return rounds / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, nargs='+', default=[5, 20])
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"формат: {'msgpack' if use_msgpack else 'json'}")
+    for length in args.steps:
+        steps = make_plan(length)
+        expected = [step.to_dict() for step in steps]
+
+        # Круговая проверка: шаги после кодека те же, исходные не изменились
+        raw = encode_steps(steps)
+        decoded = [step.to_dict() for step in decode_steps(raw)]
+        if decoded != expected or [step.to_dict() for step in steps] != expected:
+            raise SystemExit(f'Расхождение после кодирования ({length} шагов)')
+
+        old_raw = old_encode(steps)
+        for title, encode, decode, data in (('to_dict', old_encode, old_decode, old_raw),
+                                            ('codec', encode_steps, decode_steps, raw)):
+            print(f"{title:<8} steps={length:<4} size={len(data):<7} "
+                  f"encode={rate(encode, steps, args.rounds):<9.0f}/s "
+                  f"decode={rate(decode, data, args.rounds):.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
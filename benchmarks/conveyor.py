@@ -0,0 +1,231 @@
+""" Нагрузочный тест конвейера (КСС) без Telegram.
+    Для каждого типа шага и длины конвейера: переходы next_step в секунду,
+    перцентили задержки шага, операции хранилища и вызовы API на шаг, память на сессию.
+    Результаты пишутся в JSON, --compare сравнивает с прошлым запуском.
+
+    python -m benchmarks.conveyor --users 200 --lengths 1 5 20 --output bench.json
+    python -m benchmarks.conveyor --output new.json --compare bench.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable
+
+from benchmarks.fake_bot import callback_update, install, message_update
+from bot.main import STORAGE, botik, dp, setup_routers
+from interface.state_handlers import ChooseStepHandler
+from interface.steps_datatype import (
+    ConfirmStepData, CustomStepData, ImageStepData, InlineStepData, IntStepData,
+    OptionStepData, PagesStepData, StepMessage, StringStepData, TimeStepData
+)
+from interface.utils import list_to_inline
+
+
+# Операции хранилища, которые считаются на шаг
+storage_methods = ['get_state', 'set_state', 'get_data', 'set_data',
+                   'get_state_data', 'update_data', 'update_fields']
+
+pages_options = {f'I{i}': i for i in range(50)}
+
+
+def inline_step(name: str, index: int) -> InlineStepData:
+    code = f'b{index}'
+    markup = list_to_inline([{'text': 'X', 'callback_data': f'chooseinline {code} x'}])
+    return InlineStepData(name, StepMessage('inline', markup), data={'custom_code': code})
+
+# Тип шага -> (создание шага, ответ пользователя на шаг)
+step_types: dict[str, tuple[Callable, Callable]] = {
+    'int': (lambda name, i: IntStepData(name, StepMessage('int'),
+                                        data={'min_int': 1, 'max_int': 100}),
+            lambda user, i: message_update(user, '5')),
+    'str': (lambda name, i: StringStepData(name, StepMessage('str'),
+                                           data={'min_len': 1, 'max_len': 50}),
+            lambda user, i: message_update(user, 'hello')),
+    'time': (lambda name, i: TimeStepData(name, StepMessage('time'),
+                                          data={'min_int': 1, 'max_int': 86400}),
+             lambda user, i: message_update(user, '10m')),
+    'bool': (lambda name, i: ConfirmStepData(name, StepMessage('bool')),
+             lambda user, i: message_update(user, 'Да')),
+    'option': (lambda name, i: OptionStepData(name, StepMessage('option'),
+                                              data={'options': {'A': 1, 'B': 2}}),
+               lambda user, i: message_update(user, 'A')),
+    'inline': (inline_step,
+               lambda user, i: callback_update(user, f'chooseinline b{i} x')),
+    'pages': (lambda name, i: PagesStepData(name, StepMessage('pages'),
+                                            data={'options': pages_options}),
+              lambda user, i: message_update(user, 'I3')),
+    'custom': (lambda name, i: CustomStepData(name, StepMessage('custom'),
+                                              data={'custom_handler': 'bot.handlers.tests.custom_handler'}),
+               lambda user, i: message_update(user, 'benchmark')),
+    'image': (lambda name, i: ImageStepData(name, StepMessage('image')),
+              lambda user, i: message_update(user, '0')),
+}
+
+completed: Counter = Counter()
+
+async def finish(answer, transmitted_data):
+    completed[transmitted_data['userid']] += 1
+
+def make_steps(step_type: str, length: int) -> list:
+    make_step = step_types[step_type][0]
+    return [make_step(f'{step_type}_{i}', i) for i in range(length)]
+
+
+def count_storage_ops(counter: Counter) -> Callable:
+    """ Считает вызовы методов хранилища (обёртки на экземпляре), возвращает функцию отмены
+    """
+    originals = {}
+    for name in storage_methods:
+        method = getattr(STORAGE, name, None)
+        if method is None:
+            continue
+        originals[name] = method
+
+        def counted(*args, _name=name, _method=method, **kwargs):
+            counter[_name] += 1
+            return _method(*args, **kwargs)
+        setattr(STORAGE, name, counted)
+
+    def restore():
+        for name in originals:
+            delattr(STORAGE, name)
+    return restore
+
+def percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_case(step_type: str, length: int, users: int, first_user: int) -> dict:
+    answer = step_types[step_type][1]
+    user_ids = range(first_user, first_user + users)
+
+    for user_id in user_ids:
+        await ChooseStepHandler(finish, user_id, user_id, 'ru',
+                                steps=make_steps(step_type, length)).start()
+
+    ops: Counter = Counter()
+    restore = count_storage_ops(ops)
+    session = botik.session
+    calls_before = len(session.calls)
+    timings = []
+
+    start = time.perf_counter()
+    try:
+        for index in range(length):
+            for user_id in user_ids:
+                step_start = time.perf_counter()
+                await dp.feed_raw_update(botik, answer(user_id, index))
+                timings.append(time.perf_counter() - step_start)
+    finally:
+        restore()
+    total = time.perf_counter() - start
+
+    transitions = len(timings)
+    timings.sort()
+    return {
+        'type': step_type,
+        'length': length,
+        'users': users,
+        'transitions': transitions,
+        'transitions_per_s': transitions / total,
+        'p50_us': percentile(timings, 0.5) * 1e6,
+        'p90_us': percentile(timings, 0.9) * 1e6,
+        'p99_us': percentile(timings, 0.99) * 1e6,
+        'mean_us': statistics.fmean(timings) * 1e6,
+        'storage_ops_per_step': {name: count / transitions for name, count in sorted(ops.items())},
+        'api_calls_per_step': (len(session.calls) - calls_before) / transitions,
+        'completed': sum(1 for user_id in user_ids if completed[user_id]),
+    }
+
+async def session_memory(step_type: str, length: int, sessions: int, first_user: int) -> float:
+    """ Байт на запущенную (ещё не завершённую) сессию
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id in range(first_user, first_user + sessions):
+        await ChooseStepHandler(finish, user_id, user_id, 'ru',
+                                steps=make_steps(step_type, length)).start()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / sessions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(i['type'], i['length']): i for i in json.load(f)['results']}
+
+    print(f"\nСравнение с {baseline_path}")
+    for res in results:
+        old = baseline.get((res['type'], res['length']))
+        if not old:
+            continue
+        print(f"{res['type']:<7} len={res['length']:<3} "
+              f"tps x{res['transitions_per_s'] / old['transitions_per_s']:.2f} "
+              f"p99 x{res['p99_us'] / old['p99_us']:.2f} "
+              f"mem x{res['bytes_per_session'] / old['bytes_per_session']:.2f}")
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--memory-sessions', type=int, default=1000)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--types', nargs='+', default=list(step_types), choices=list(step_types))
+    parser.add_argument('--output', help='файл для результатов (JSON)')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    install(botik)
+    setup_routers()
+
+    results = []
+    first_user = 1
+    for step_type in args.types:
+        for length in args.lengths:
+            res = await run_case(step_type, length, args.users, first_user)
+            first_user += args.users
+            res['bytes_per_session'] = await session_memory(step_type, length,
+                                                            args.memory_sessions, first_user)
+            first_user += args.memory_sessions
+            botik.session.calls.clear()
+
+            results.append(res)
+            print(f"{step_type:<7} len={length:<3} tps={res['transitions_per_s']:<8.0f} "
+                  f"p50={res['p50_us']:.0f}us p99={res['p99_us']:.0f}us "
+                  f"ops/step={sum(res['storage_ops_per_step'].values()):.1f} "
+                  f"api/step={res['api_calls_per_step']:.1f} "
+                  f"mem={res['bytes_per_session']:.0f}B "
+                  f"completed={res['completed']}/{args.users}")
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'storage': type(STORAGE).__name__,
+        'time': int(time.time()),
+        'params': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+""" Бот без сети для бенчмарков: запросы к API не уходят в Telegram,
+    а отвечают заглушкой через latency секунд.
+"""
+import asyncio
+import datetime
+import itertools
+import os
+
+os.environ.setdefault('BOT_TOKEN', '42:BENCHMARK')
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message, PhotoSize
+
+
+class FakeSession(BaseSession):
+    """ Сессия, которая считает запросы и возвращает правдоподобные ответы
+    """
+
+    def __init__(self, latency: float = 0.0, record: bool = True):
+        super().__init__()
+        self.latency: float = latency
+        self.record: bool = record
+        self.calls: list[TelegramMethod] = []
+        self.message_ids = itertools.count(100_000)
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout=None):
+        if self.record:
+            self.calls.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        name = type(method).__name__
+        if name in ('SendMessage', 'SendPhoto', 'EditMessageText', 'EditMessageCaption'):
+            photo = None
+            if name == 'SendPhoto':
+                photo = [PhotoSize(file_id=f'fake{len(self.calls)}', file_unique_id='fake',
+                                   width=1, height=1)]
+            return Message(message_id=next(self.message_ids),
+                           date=datetime.datetime.now(),
+                           chat=Chat(id=method.chat_id, type='private'),
+                           text=getattr(method, 'text', None), photo=photo)
+        return True
+
+
+def install(bot: Bot, latency: float = 0.0, record: bool = True) -> FakeSession:
+    """ Подменяет сессию бота и снимает лимиты SendScheduler
+        (меряем обработку обновлений, а не ограничения Telegram)
+    """
+    from interface.scheduler import TokenBucket, send_scheduler
+
+    session = FakeSession(latency, record)
+    bot.session = session
+
+    send_scheduler.chat_rate = send_scheduler.chat_burst = 1e9
+    send_scheduler.chat_buckets.clear()
+    send_scheduler.global_bucket = TokenBucket(1e9, 1e9)
+    return session
+
+
+update_ids = itertools.count(1)
+
+def message_update(user_id: int, text: str) -> dict:
+    """ Сырой update с текстовым сообщением пользователя user_id
+    """
+    update_id = next(update_ids)
+    entities = None
+    if text.startswith('/'):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+
+    message = {
+        'message_id': update_id,
+        'date': int(datetime.datetime.now().timestamp()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench',
+                 'language_code': 'ru'},
+        'text': text,
+    }
+    if entities:
+        message['entities'] = entities
+    return {'update_id': update_id, 'message': message}
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> dict:
+    """ Сырой update с нажатием inline кнопки под сообщением бота message_id
+    """
+    update_id = next(update_ids)
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench',
+                     'language_code': 'ru'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(datetime.datetime.now().timestamp()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'inline',
+            },
+        },
+    }
+
+def steps_dialog(user_id: int) -> list[dict]:
+    """ Полный диалог /steps из bot/handlers/tests.py
+    """
+    return [message_update(user_id, text) for text in ('/steps', '30', 'Bench', 'Да')]
+
+def completed_users(session: FakeSession) -> set[int]:
+    """ Пользователи, у которых конвейер /steps дошёл до конца
+    """
+    return {method.chat_id for method in session.calls
+            if type(method).__name__ == 'SendMessage'
+            and str(method.text).startswith('Step sequence completed')}
@@ -0,0 +1,80 @@
+""" Память состояний пользователей, запустивших один и тот же конвейер (MemoryStorage).
+    --copy повторяет старое поведение: свои копии данных шага у каждого пользователя.
+
+    python -m benchmarks.memory --sessions 10000 100000
+"""
+import argparse
+import asyncio
+import copy
+import gc
+import time
+import tracemalloc
+
+from benchmarks.fake_bot import install
+from bot.main import STORAGE, botik
+from interface.conveyor import ConveyorPlan
+from interface.state_handlers import ChooseStepHandler
+from interface.steps_datatype import IntStepData, PagesStepData, StepMessage
+
+
+async def finish(answer, transmitted_data):
+    pass
+
+def broadcast_steps() -> list:
+    """ Типичная рассылка: выбор из большого списка и ввод числа
+    """
+    options = {f'Товар {i}': {'id': i, 'price': i * 10} for i in range(200)}
+    return [
+        PagesStepData('item', StepMessage('Выберите товар из списка ниже'),
+                      data={'options': options, 'horizontal': 2, 'vertical': 4}),
+        IntStepData('count', StepMessage('Сколько штук?'), data={'min_int': 1, 'max_int': 99}),
+    ]
+
+async def run_sessions(sessions: int, copy_data: bool) -> dict:
+    STORAGE.storage.clear()
+    gc.collect()
+
+    original = ConveyorPlan.get_handler_data
+    if copy_data:
+        ConveyorPlan.get_handler_data = lambda self, process: copy.deepcopy(self.handler_data[process])
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        for user_id in range(sessions):
+            await ChooseStepHandler(finish, user_id, user_id, 'ru',
+                                    steps=broadcast_steps()).start()
+    finally:
+        ConveyorPlan.get_handler_data = original
+
+    total = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return {'bytes_per_session': used / sessions, 'total_mb': used / 2 ** 20,
+            'start_us': total / sessions * 1e6}
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--copy-limit', type=int, default=10_000,
+                        help='режим copy только до стольких сессий (~60KB на сессию)')
+    args = parser.parse_args()
+
+    if not hasattr(STORAGE, 'storage'):
+        raise SystemExit('Бенчмарк рассчитан на CSS_STORAGE=memory')
+
+    install(botik, record=False)
+    for sessions in args.sessions:
+        for title, copy_data in (('shared', False), ('copy', True)):
+            if copy_data and sessions > args.copy_limit:
+                continue
+            res = await run_sessions(sessions, copy_data)
+            print(f"{title:<7} sessions={sessions:<7} total={res['total_mb']:.1f}MB "
+                  f"per_session={res['bytes_per_session']:.0f}B start={res['start_us']:.0f}us")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+""" Поиск варианта по тексту пользователя (interface/option_index.py) против
+    перебора options с нормализацией каждого ключа. Проверяет совпадение
+    результатов и меряет поиски в секунду; для inline - размер callback_data
+    с данными и с короткими id.
+
+    python -m benchmarks.options --sizes 10 100 1000 --lookups 20000
+"""
+import argparse
+import json
+import os
+import random
+import time
+from typing import Callable, Optional
+
+os.environ.setdefault('BOT_TOKEN', '42:BENCHMARK')
+
+from interface.option_index import (
+    CALLBACK_DATA_LIMIT, OptionIndex, inline_buttons, match_option, normalize_option, store_index
+)
+
+
+def scan_option(options: dict, text: Optional[str], prefix: bool = False) -> Optional[str]:
+    """ Без индекса: нормализация всех ключей на каждый ввод
+    """
+    if not text:
+        return None
+    if text in options:
+        return text
+
+    norm = normalize_option(text)
+    if not norm:
+        return None
+    exact = [key for key in options if normalize_option(key) == norm]
+    if exact or not prefix:
+        return exact[0] if len(exact) == 1 else None
+    starts = [key for key in options if normalize_option(key).startswith(norm)]
+    return starts[0] if len(starts) == 1 else None
+
+def make_options(size: int, rnd: random.Random) -> dict:
+    words = ['Red', 'Green', 'Blue', 'Big', 'Small', 'Apple', 'Pear', 'Plum', 'Box', 'Item']
+    options = {}
+    while len(options) < size:
+        options[f'{rnd.choice(words)} {rnd.choice(words)} {len(options)}'] = len(options)
+    return options
+
+def make_inputs(options: dict, count: int, rnd: random.Random) -> list[str]:
+    keys = list(options)
+    inputs = []
+    for _ in range(count):
+        key = rnd.choice(keys)
+        kind = rnd.random()
+        if kind < 0.25:
+            inputs.append(key)
+        elif kind < 0.5:
+            inputs.append(f'  {key.upper()} ')
+        elif kind < 0.75:
+            inputs.append(key.lower()[:rnd.randint(1, len(key))])
+        else:
+            inputs.append(f'{key} x')
+    return inputs
+
+def rate(func: Callable, options: dict, inputs: list, *args) -> float:
+    start = time.perf_counter()
+    for text in inputs:
+        func(options, text, True, *args)
+    return len(inputs) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    for size in args.sizes:
+        options = make_options(size, rnd)
+        inputs = make_inputs(options, args.lookups, rnd)
+        # Индекс строится один раз (как в setup() обработчика), поиск - по его id
+        options_id = store_index(options)
+
+        for text in inputs:
+            for prefix in (False, True):
+                if match_option(options, text, prefix, options_id) != scan_option(options, text, prefix):
+                    raise SystemExit(f'Расхождение: {text!r} (prefix={prefix}, {size} вариантов)')
+
+        start = time.perf_counter()
+        OptionIndex(tuple(options))
+        index_build = time.perf_counter() - start
+
+        # Перебор меряется на части входов - на больших наборах он медленный
+        sample = inputs[:max(100, args.lookups * 10 // size)]
+        print(f"options={size:<5} index={index_build * 1e3:<6.2f}ms "
+              f"index_lookup={rate(match_option, options, inputs, options_id):<9.0f}/s "
+              f"scan_lookup={rate(scan_option, options, sample):.0f}/s")
+
+    payload = {'id': 'x' * 40, 'filters': ['a', 'b']}
+    full = f'chooseinline code {json.dumps(payload)}'
+    compact = inline_buttons('code', {'Button': payload})[0]['callback_data']
+    print(f"callback_data: с данными {len(full.encode())}B, с id {len(compact.encode())}B "
+          f"(предел {CALLBACK_DATA_LIMIT}B)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+""" Масштабирование многопроцессного запуска (bot/sharded.py) по числу воркеров.
+    Мастер раздаёт синтетические диалоги /steps, воркеры работают с фейковым API.
+
+    python -m benchmarks.sharded --users 2000 --workers 1 2 4
+"""
+import argparse
+import os
+import time
+
+from benchmarks.fake_bot import completed_users, install, steps_dialog
+from bot.main import botik
+from bot.sharded import ShardedRunner
+
+
+def worker_setup(latency: float):
+    def setup():
+        session = install(botik, latency)
+        return lambda: {'completed': len(completed_users(session))}
+    return setup
+
+def run_workers(workers: int, users: int, latency: float) -> dict:
+    runner = ShardedRunner(workers, setup=worker_setup(latency))
+    runner.start()
+
+    dialogs = [steps_dialog(10_000 + i) for i in range(users)]
+    start = time.perf_counter()
+    # Шаги диалога отправляются по очереди, пользователи вперемешку
+    for step in range(len(dialogs[0])):
+        for dialog in dialogs:
+            runner.dispatch(dialog[step])
+    stats = runner.stop()
+    total = time.perf_counter() - start
+
+    return {
+        'updates': sum(len(dialog) for dialog in dialogs),
+        'total_s': total,
+        'completed': sum(i.get('completed', 0) for i in stats),
+        'per_worker': [i.get('processed', 0) for i in stats],
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='задержка ответа API, сек')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, min(4, os.cpu_count() or 1)}))
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        res = run_workers(workers, args.users, args.latency)
+        print(f"workers={workers:<3} updates={res['updates']:<7} "
+              f"total={res['total_s']:.2f}s rate={res['updates'] / res['total_s']:.0f} upd/s "
+              f"completed={res['completed']}/{args.users} per_worker={res['per_worker']}")
+
+
+if __name__ == '__main__':
+    main()
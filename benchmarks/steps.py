@@ -0,0 +1,82 @@
+""" Объекты шагов в масштабе конвейеров: память на объект, время создания,
+    to_handler_data и to_dict в секунду для каждого типа шага.
+
+    python -m benchmarks.steps --objects 100000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.conveyor import step_types
+from interface.codec import decode_steps, encode_steps
+from interface.steps_datatype import BaseDataType, StepMessage
+
+
+class DataKeysStepData(BaseDataType):
+    """ Свой шаг, объявивший только data_keys (без fields и __slots__)
+    """
+    type: str = 'int'
+    data_keys: list[str] = ['max_int', 'min_int']
+
+    def __init__(self, name, message, data=None):
+        self.max_int = 10
+        self.min_int = 1
+        self.extra = 'x'
+        super().__init__(name, message, data)
+
+def check_data_keys_step() -> None:
+    step = DataKeysStepData('n', StepMessage('n'), data={'max_int': 99})
+    if step.to_dict()['data']['max_int'] != 99 or step.to_handler_data()['max_int'] != 99:
+        raise SystemExit('Значение data_keys из data потеряно')
+    if step.to_dict().get('extra') != 'x' or step.to_handler_data().get('extra') != 'x':
+        raise SystemExit('Атрибут вне fields потерян')
+    if decode_steps(encode_steps([step]))[0].to_handler_data()['max_int'] != 99:
+        raise SystemExit('Значение data_keys из data потеряно после кодека')
+
+
+def measure(step_type: str, objects: int, rounds: int) -> dict:
+    make_step = step_types[step_type][0]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    steps = [make_step(f'{step_type}_{i}', i) for i in range(objects)]
+    create = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    sample = steps[:rounds]
+    start = time.perf_counter()
+    for step in sample:
+        step.to_handler_data()
+    handler_data = len(sample) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for step in sample:
+        step.to_dict()
+    to_dict = len(sample) / (time.perf_counter() - start)
+
+    return {'bytes_per_object': used / objects, 'create_us': create / objects * 1e6,
+            'handler_data_per_s': handler_data, 'to_dict_per_s': to_dict}
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=100_000)
+    parser.add_argument('--rounds', type=int, default=20_000)
+    parser.add_argument('--types', nargs='+', default=list(step_types), choices=list(step_types))
+    args = parser.parse_args()
+
+    check_data_keys_step()
+    for step_type in args.types:
+        res = measure(step_type, args.objects, args.rounds)
+        print(f"{step_type:<7} mem={res['bytes_per_object']:<6.0f}B "
+              f"create={res['create_us']:<5.2f}us "
+              f"to_handler_data={res['handler_data_per_s']:<9.0f}/s "
+              f"to_dict={res['to_dict_per_s']:.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
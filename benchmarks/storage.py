@@ -0,0 +1,100 @@
+""" Сравнение задержки одного перехода КСС для разных FSM хранилищ.
+
+    python -m benchmarks.storage --users 1000 --steps 30
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from interface.storage import create_storage
+
+
+def make_payload(user_id: int, process: int) -> dict:
+    """ Данные состояния, похожие на данные обработчика внутри конвейера
+    """
+    return {
+        'function': 'interface.state_handlers.next_step',
+        'userid': user_id, 'chatid': user_id, 'lang': 'ru',
+        'min_int': 1, 'max_int': 100,
+        'messages_list': [],
+        'time_start': int(time.time()),
+        'transmitted_data': {
+            'userid': user_id, 'chatid': user_id, 'lang': 'ru',
+            'return_function': 'bot.handlers.tests.end_step_sequence',
+            'plan': 'f' * 40, 'process': process,
+            'return_data': {f'step_{i}': i for i in range(process)},
+            'step_state': {'bmessageid': 1000 + process},
+        }
+    }
+
+async def transition(storage, key: StorageKey, process: int) -> None:
+    """ Операции хранилища на одном шаге: фильтр состояния, чтение,
+        очистка, запуск следующего обработчика и запись id сообщения
+    """
+    await storage.get_state(key)
+    data = await storage.get_data(key)
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+
+    data = make_payload(key.user_id, process)
+    await storage.set_state(key, 'GeneralStates:ChooseInt')
+    await storage.set_data(key, data)
+
+    # next_step дописывает только id сообщения шага (дельта, если хранилище умеет)
+    step_state = data['transmitted_data']['step_state']
+    if hasattr(storage, 'update_fields'):
+        await storage.update_fields(key, 'transmitted_data', {'step_state': step_state}, [])
+    else:
+        await storage.update_data(key, {'transmitted_data': data['transmitted_data']})
+
+async def run_backend(name: str, users: int, steps: int, **kwargs) -> dict:
+    storage = create_storage(name, **kwargs)
+    keys = [StorageKey(bot_id=42, chat_id=i, user_id=i) for i in range(users)]
+    timings = []
+
+    for process in range(steps):
+        for key in keys:
+            start = time.perf_counter()
+            await transition(storage, key, process)
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await storage.close()
+    close_time = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        'transitions': len(timings),
+        'mean_us': statistics.fmean(timings) * 1e6,
+        'p50_us': timings[len(timings) // 2] * 1e6,
+        'p99_us': timings[int(len(timings) * 0.99)] * 1e6,
+        'close_ms': close_time * 1e3,
+    }
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'memory': ('memory', {}),
+            'sqlite': ('sqlite', {'path': os.path.join(tmp, 'batched.db')}),
+            'sqlite (batch_size=1)': ('sqlite', {'path': os.path.join(tmp, 'single.db'),
+                                                 'batch_size': 1}),
+        }
+        for title, (name, kwargs) in backends.items():
+            res = await run_backend(name, args.users, args.steps, **kwargs)
+            print(f"{title:<24} transitions={res['transitions']:<7} "
+                  f"mean={res['mean_us']:.1f}us p50={res['p50_us']:.1f}us "
+                  f"p99={res['p99_us']:.1f}us close={res['close_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+""" str_to_seconds / seconds_to_str против прежних реализаций: вызовы в секунду.
+    Совпадение с прежними реализациями проверяет tests/test_time.py.
+
+    python -m benchmarks.time_parse --cases 100000
+"""
+import argparse
+import os
+import random
+import time
+from typing import Callable
+
+os.environ.setdefault('BOT_TOKEN', '42:BENCHMARK')
+
+from interface.utils import seconds_to_str, str_to_seconds
+
+
+def legacy_seconds_to_str(seconds, lang='en', mini=False, max_lvl='auto'):
+    """ seconds_to_str до таблиц (язык не учитывался - всегда русский)
+    """
+    if seconds == 'inf': return "♾"
+    if seconds < 0: seconds = 0
+
+    time_format = {
+        'year': ['год', 'года', 'лет', 'г.'],
+        'month': ['месяц', 'месяца', 'месяцев', 'мес.'],
+        'weekly': ['неделя', 'недели', 'недель', 'нед.'],
+        'day': ['день', 'дня', 'дней', 'д.'],
+        'hour': ['час', 'часа', 'часов', 'ч.'],
+        'minute': ['минута', 'минуты', 'минут', 'мин.'],
+        'second': ['секунда', 'секунды', 'секунд', 'сек.']
+    }
+    result = ''
+
+    def ending_w(time_type, unit):
+        if mini: return time_format[time_type][3]
+        result = ''
+        if unit < 11 or unit > 14:
+            unit = unit % 10
+        if unit == 1:
+            result = time_format[time_type][0]
+        elif unit > 1 and unit <= 4:
+            result = time_format[time_type][1]
+        elif unit > 4 or unit == 0:
+            result = time_format[time_type][2]
+        return result
+
+    time_calculation = {
+        'year': 31_536_000, 'month': 2_592_000, 'weekly': 604800,
+        'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1
+    }
+    data = dict.fromkeys(time_calculation, 0)
+    left = seconds
+    for tp, unit in time_calculation.items():
+        tt = left // unit
+        if tt:
+            left -= tt * unit
+            data[tp] = tt
+
+    if max_lvl == 'auto':
+        max_lvl, a, lst_n = 'second', 0, 'second'
+        for tp, unit in data.items():
+            if unit:
+                a += 1
+                lst_n = tp
+            if a >= 3:
+                max_lvl = tp
+                break
+        if a < 3: max_lvl = lst_n
+
+    for tp, unit in data.items():
+        if unit:
+            if mini:
+                result += f'{unit}{ending_w(tp, unit)} '
+            else:
+                result += f'{unit} {ending_w(tp, unit)} '
+        if max_lvl == tp: break
+
+    if result[:-1]: return result[:-1]
+    result = '0'
+    if max_lvl != 'second':
+        return f'0 {time_format[max_lvl][3]}'
+    return result
+
+def legacy_str_to_seconds(text):
+    """ str_to_seconds до регулярного выражения
+    """
+    seconds = 0
+    for i in text.split():
+        mn = 1
+        if len(i) == 1 and i.isdigit(): seconds += int(i)
+        if len(i) > 1:
+            number = i[:-1]
+            if number.isdigit():
+                if i[:-1] == 's': mn = 1
+                elif i[-1] == 'm': mn = 60
+                elif i[-1] == 'h': mn = 3600
+                elif i[-1] == 'd': mn = 86400
+                elif i[-1] == 'w': mn = 86400 * 7
+                seconds += int(number) * mn
+    return seconds
+
+
+levels = ['auto', 'year', 'month', 'weekly', 'day', 'hour', 'minute', 'second']
+
+def random_seconds(rnd: random.Random) -> int:
+    # До 110 лет: прежняя форма слова для 111+ лет была неверной ("111 год")
+    return rnd.choice([rnd.randint(0, 120), rnd.randint(0, 100_000),
+                       rnd.randint(0, 110 * 31_536_000)])
+
+def random_time_text(rnd: random.Random) -> str:
+    # Слова, которые прежний парсер понимал верно: одна цифра или число с суффиксом
+    words = []
+    for _ in range(rnd.randint(1, 4)):
+        if rnd.random() < 0.2:
+            words.append(str(rnd.randint(0, 9)))
+        else:
+            words.append(f'{rnd.randint(1, 999)}{rnd.choice("smhdw")}')
+    return ' '.join(words)
+
+def rate(func: Callable, inputs: list) -> float:
+    start = time.perf_counter()
+    for args in inputs:
+        func(*args)
+    return len(inputs) / (time.perf_counter() - start)
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    format_inputs = [(random_seconds(rnd), 'ru') for _ in range(args.cases)]
+    parse_inputs = [(random_time_text(rnd),) for _ in range(args.cases)]
+
+    for title, func, inputs in (('seconds_to_str', seconds_to_str, format_inputs),
+                                ('legacy', legacy_seconds_to_str, format_inputs),
+                                ('str_to_seconds', str_to_seconds, parse_inputs),
+                                ('legacy', legacy_str_to_seconds, parse_inputs)):
+        print(f"{title:<15} {rate(func, inputs):.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+""" Пропускная способность webhook режима на синтетических обновлениях.
+    Каждый пользователь проходит диалог /steps, запросы разных пользователей идут параллельно.
+
+    python -m benchmarks.webhook --users 200 --latency 0.02
+"""
+import argparse
+import asyncio
+import time
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from benchmarks.fake_bot import completed_users, install, steps_dialog
+from bot.main import botik, dp, setup_routers
+from bot.webhook import create_app
+
+
+SECRET = 'benchmark'
+
+async def run_workers(workers: int, users: int, latency: float) -> dict:
+    session = install(botik, latency)
+    app = create_app(dp, botik, path='/webhook', secret_token=SECRET, workers=workers)
+    handler = app['css_webhook_handler']
+
+    async with TestServer(app) as server, ClientSession() as client:
+        url = str(server.make_url('/webhook'))
+        headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+
+        async def user(user_id: int) -> None:
+            for update in steps_dialog(user_id):
+                async with client.post(url, json=update, headers=headers) as resp:
+                    assert resp.status == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(10_000 + i) for i in range(users)))
+        accepted = time.perf_counter() - start
+        await handler.pool.join()
+        total = time.perf_counter() - start
+
+    return {
+        'updates': users * 4,
+        'accepted_s': accepted,
+        'total_s': total,
+        'completed': len(completed_users(session)),
+        'api_calls': len(session.calls),
+    }
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='задержка ответа API, сек')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 64])
+    args = parser.parse_args()
+
+    setup_routers()
+    for workers in args.workers:
+        res = await run_workers(workers, args.users, args.latency)
+        print(f"workers={workers:<4} updates={res['updates']:<6} "
+              f"accepted={res['accepted_s']:.2f}s total={res['total_s']:.2f}s "
+              f"rate={res['updates'] / res['total_s']:.0f} upd/s "
+              f"completed={res['completed']}/{args.users} api_calls={res['api_calls']}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
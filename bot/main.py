@@ -1,24 +1,68 @@
 from aiogram import Bot, Dispatcher, Router
-from aiogram.fsm.storage.memory import MemoryStorage
 import asyncio
 from os import getenv
 from dotenv import load_dotenv
 
+from interface.storage import create_storage
+
 load_dotenv()
 
 botik = Bot(getenv('BOT_TOKEN'))
-STORAGE = MemoryStorage()
+
+storage_kwargs = {}
+if getenv('CSS_STORAGE_PATH'):
+    storage_kwargs['path'] = getenv('CSS_STORAGE_PATH')
+STORAGE = create_storage(getenv('CSS_STORAGE', 'memory'), **storage_kwargs)
 
 dp = Dispatcher(storage=STORAGE)
 css_router = Router()
 test_router = Router()
 
-def run():
+def setup_routers():
     import interface.handlers
     import bot.handlers
 
-    print("Бот запущен")
-
     dp.include_router(css_router)
     dp.include_router(test_router)
-    asyncio.run(dp.start_polling(botik))
\ No newline at end of file
+
+def run():
+    setup_routers()
+
+    print("Бот запущен")
+    asyncio.run(dp.start_polling(botik))
+
+def run_webhook():
+    """ Запуск через webhook (aiohttp).
+        CSS_WEBHOOK_URL - внешний адрес, на него будет установлен webhook
+    """
+    from aiohttp import web
+    from bot.webhook import create_app
+
+    setup_routers()
+
+    path = getenv('CSS_WEBHOOK_PATH', '/webhook')
+    secret = getenv('CSS_WEBHOOK_SECRET')
+    url = getenv('CSS_WEBHOOK_URL')
+
+    app = create_app(dp, botik, path=path, secret_token=secret,
+                     workers=int(getenv('CSS_WEBHOOK_WORKERS', 64)))
+
+    from interface.metrics import metrics, metrics_handler
+    if metrics.enabled:
+        app.router.add_get('/metrics', metrics_handler)
+
+    async def on_startup(app):
+        if url:
+            await botik.set_webhook(url.rstrip('/') + path, secret_token=secret,
+                                    drop_pending_updates=False)
+
+    async def on_shutdown(app):
+        # Обновления уже доработаны (KeyedRequestHandler.close), сбрасываем хранилище
+        await STORAGE.close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+
+    print("Бот запущен (webhook)")
+    web.run_app(app, host=getenv('CSS_WEBHOOK_HOST', '0.0.0.0'),
+                port=int(getenv('CSS_WEBHOOK_PORT', 8080)))
\ No newline at end of file
@@ -0,0 +1,155 @@
+import asyncio
+import itertools
+import json
+import multiprocessing
+import signal
+from functools import partial
+from multiprocessing.connection import Connection
+from typing import Callable, Optional
+
+from bot.main import STORAGE, botik, dp, setup_routers
+from bot.webhook import KeyedWorkerPool, update_key
+from interface.scheduler import send_scheduler
+from interface.tracing import flush_spans
+
+
+def shard_for(key: Optional[tuple], shards: int, counter=itertools.count()) -> int:
+    """ Номер воркера для обновления: один пользователь - всегда один воркер.
+        Обновления без пользователя раздаются по кругу.
+    """
+    if key is None:
+        return next(counter) % shards
+    # hash кортежа чисел детерминирован между процессами
+    return hash(key) % shards
+
+
+async def _worker_loop(conn: Connection, concurrency: int) -> dict:
+    pool = KeyedWorkerPool(concurrency)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_readable():
+        try:
+            queue.put_nowait(conn.recv_bytes())
+        except EOFError:
+            # Мастер завершился
+            loop.remove_reader(conn.fileno())
+            queue.put_nowait(b'')
+
+    loop.add_reader(conn.fileno(), on_readable)
+
+    processed = 0
+    while raw := await queue.get():
+        update = json.loads(raw)
+        pool.submit(update_key(update), partial(dp.feed_raw_update, botik, update))
+        processed += 1
+
+    loop.remove_reader(conn.fileno())
+    await pool.join()
+    await STORAGE.close()
+    await botik.session.close()
+    # Процесс завершается через os._exit - atexit не сработает
+    flush_spans()
+    return {'processed': processed}
+
+def _worker_main(conn: Connection, concurrency: int, setup: Optional[Callable],
+                 workers: int = 1) -> None:
+    # Ctrl+C останавливает мастера, воркеры дорабатывают очередь по его команде
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Глобальный лимит Telegram общий для бота - у каждого воркера своя доля
+    send_scheduler.share_global(workers)
+
+    # setup может вернуть функцию, результат которой добавится в статистику воркера
+    report = setup() if setup else None
+    setup_routers()
+
+    stats = asyncio.run(_worker_loop(conn, concurrency))
+    if callable(report):
+        stats.update(report())
+    try:
+        conn.send(stats)
+    except (BrokenPipeError, EOFError):
+        pass
+    conn.close()
+
+
+class ShardedRunner():
+    """
+    Запуск бота в нескольких процессах (fork).
+    Мастер получает обновления и отправляет их воркерам по hash((chat_id, user_id)),
+    поэтому конвейер пользователя всегда выполняется в одном процессе.
+    Состояния между процессами - через общее хранилище (CSS_STORAGE=sqlite).
+    """
+
+    def __init__(self, workers: int = 2, concurrency: int = 64,
+                 setup: Optional[Callable] = None):
+        self.workers_count: int = workers
+        self.concurrency: int = concurrency
+        self.setup: Optional[Callable] = setup
+        self.processes: list[multiprocessing.Process] = []
+        self.connections: list[Connection] = []
+
+    def start(self) -> None:
+        """ Запускает воркеров. Вызывать до любых запросов бота в мастере
+        """
+        context = multiprocessing.get_context('fork')
+        for _ in range(self.workers_count):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_main,
+                                      args=(child_conn, self.concurrency, self.setup,
+                                            self.workers_count),
+                                      daemon=True)
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.connections.append(parent_conn)
+
+    def dispatch(self, update: dict) -> None:
+        shard = shard_for(update_key(update), self.workers_count)
+        self.connections[shard].send_bytes(json.dumps(update).encode())
+
+    def stop(self) -> list[dict]:
+        """ Останавливает воркеров после обработки отправленных обновлений
+        """
+        stats = []
+        for conn in self.connections:
+            conn.send_bytes(b'')
+        for conn, process in zip(self.connections, self.processes):
+            try:
+                stats.append(conn.recv())
+            except EOFError:
+                stats.append({})
+            process.join()
+            conn.close()
+
+        self.processes, self.connections = [], []
+        return stats
+
+    async def poll(self, timeout: int = 30) -> None:
+        """ Long polling в мастере: обновления только раздаются воркерам
+        """
+        setup_routers()
+        allowed_updates = dp.resolve_used_update_types()
+        offset = None
+
+        while True:
+            updates = await botik.get_updates(offset=offset, timeout=timeout,
+                                              allowed_updates=allowed_updates)
+            for update in updates:
+                self.dispatch(update.model_dump(mode='json', by_alias=True,
+                                                exclude_none=True))
+                offset = update.update_id + 1
+
+
+def run_sharded(workers: int, concurrency: int = 64) -> None:
+    runner = ShardedRunner(workers, concurrency)
+    runner.start()
+
+    print(f"Бот запущен ({workers} процессов)")
+    try:
+        asyncio.run(runner.poll())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from interface.metrics import metrics
+
+
+def update_key(update: dict) -> Optional[tuple]:
+    """ Ключ очереди обновления - (chat_id, user_id) из сырого update.
+        None - у обновления нет пользователя и чата, порядок не важен.
+    """
+    for name, event in update.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+
+        user = (event.get('from') or event.get('user') or {}).get('id')
+        chat = event.get('chat') or (event.get('message') or {}).get('chat') or {}
+        chat_id = chat.get('id')
+        if user is None and chat_id is None:
+            return None
+        return chat_id, user
+    return None
+
+
+class KeyedWorkerPool():
+    """
+    Параллельная обработка задач с сохранением порядка внутри ключа.
+    Задачи одного ключа (пользователя) выполняются строго по очереди,
+    разных ключей - одновременно, но не больше workers штук.
+    """
+
+    def __init__(self, workers: int = 64):
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(workers)
+        self.queues: dict[Hashable, deque] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    def submit(self, key: Optional[Hashable], job: Callable[[], Awaitable]) -> None:
+        if key is None:
+            self._spawn(self._run_single(job))
+            return
+
+        queue = self.queues.get(key)
+        if queue is not None:
+            # У ключа уже есть обработчик - он возьмёт задачу после текущих
+            queue.append(job)
+            return
+
+        self.queues[key] = deque([job])
+        self._spawn(self._run_queue(key))
+
+    def _spawn(self, coro: Awaitable) -> None:
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _call(self, job: Callable[[], Awaitable]) -> None:
+        try:
+            await job()
+        except Exception as e:
+            metrics.inc('css_errors_total', where='update_handler')
+            print(f'KeyedWorkerPool error {e}')
+
+    async def _run_single(self, job: Callable[[], Awaitable]) -> None:
+        async with self.semaphore:
+            await self._call(job)
+
+    async def _run_queue(self, key: Hashable) -> None:
+        queue = self.queues[key]
+        try:
+            while queue:
+                async with self.semaphore:
+                    await self._call(queue[0])
+                queue.popleft()
+        finally:
+            del self.queues[key]
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def join(self) -> None:
+        """ Ожидает завершения всех принятых задач
+        """
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class KeyedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook: сразу отвечает Telegram 200,
+    а обновление ставит в KeyedWorkerPool по ключу (chat_id, user_id).
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot,
+                 secret_token: Optional[str] = None, workers: int = 64,
+                 **data: Any) -> None:
+        super().__init__(dispatcher, bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self.pool: KeyedWorkerPool = KeyedWorkerPool(workers)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        self.pool.submit(update_key(update),
+                         lambda: self._background_feed_update(bot=bot, update=update))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        # Дорабатываем уже принятые обновления, затем закрываем сессию бота
+        await self.pool.join()
+        await super().close()
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot, path: str = '/webhook',
+               secret_token: Optional[str] = None, workers: int = 64,
+               **data: Any) -> web.Application:
+    """ aiohttp приложение с webhook обработчиком по пути path
+    """
+    app = web.Application()
+    handler = KeyedRequestHandler(dispatcher, bot, secret_token=secret_token,
+                                  workers=workers, **data)
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot, **data)
+    app['css_webhook_handler'] = handler
+    return app
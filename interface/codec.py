@@ -0,0 +1,130 @@
+import json
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Optional, Union
+
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+from interface.steps_datatype import BaseDataType, BaseUpdateType, StepMessage, steps_data_registry
+from interface.storage import json_default
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Версия схемы полей. Меняется вместе с data_keys / полями StepMessage,
+# данные другой версии не декодируются
+CODEC_VERSION = 1
+
+# msgpack, если установлен; CSS_CODEC=json - всегда json
+use_msgpack: bool = msgpack is not None and getenv('CSS_CODEC', 'msgpack') == 'msgpack'
+
+StepType = Union[BaseDataType, BaseUpdateType]
+
+
+def dumps(body: Any) -> bytes:
+    """ [версия, данные] в msgpack или компактный json
+    """
+    payload = [CODEC_VERSION, body]
+    if use_msgpack:
+        return msgpack.packb(payload, use_bin_type=True, default=json_default)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'),
+                      default=json_default).encode('utf-8')
+
+def loads(raw: bytes) -> Any:
+    if raw[:1] == b'[':
+        payload = json.loads(raw)
+    elif msgpack is not None:
+        payload = msgpack.unpackb(raw, raw=False)
+    else:
+        raise ValueError("Данные в msgpack, а msgpack не установлен")
+
+    version, body = payload
+    if version != CODEC_VERSION:
+        raise ValueError(f"Версия схемы {version} не поддерживается (текущая {CODEC_VERSION})")
+    return body
+
+
+# Клавиатуры после декодирования: одна модель на одинаковое содержимое,
+# pydantic проверяет клавиатуру один раз, а не при каждом декодировании
+markup_cache: OrderedDict[str, Any] = OrderedDict()
+markup_cache_size: int = 1024
+
+def decode_markup(dump: Optional[dict]) -> Any:
+    if not isinstance(dump, dict):
+        return dump
+
+    key = json.dumps(dump, sort_keys=True, ensure_ascii=False)
+    markup = markup_cache.get(key)
+    if markup is None:
+        if 'inline_keyboard' in dump:
+            markup = InlineKeyboardMarkup(**dump)
+        else:
+            markup = ReplyKeyboardMarkup(**dump)
+        markup_cache[key] = markup
+        if len(markup_cache) > markup_cache_size:
+            markup_cache.popitem(last=False)
+    else:
+        markup_cache.move_to_end(key)
+    return markup
+
+
+# Сообщение: [text, markup, translate_message, text_data, image, parse_mode]
+
+def encode_message(message: Optional[StepMessage]) -> Optional[list]:
+    if message is None:
+        return None
+    return [message.text, message.markup_dump(exclude_none=True), message.translate_message,
+            message.text_data or None, message.image, message.parse_mode]
+
+def decode_message(body: Optional[list]) -> Optional[StepMessage]:
+    if body is None:
+        return None
+    text, markup, translate_message, text_data, image, parse_mode = body
+    return StepMessage(text, decode_markup(markup), translate_message,
+                       text_data, image, parse_mode)
+
+
+# Шаг: [type, name, message, [значения data_keys], прочие ключи data]
+# Шаг обновления: ['update', function, data]
+
+def encode_step(step: StepType) -> list:
+    if isinstance(step, BaseUpdateType):
+        return [BaseUpdateType.type, step.function, step.data or None]
+
+    data_keys = type(step).data_keys
+    values = [getattr(step, key, None) for key in data_keys]
+    extra = {key: value for key, value in step.data.items() if key not in data_keys}
+    return [step.type, step.name, encode_message(step.message), values, extra or None]
+
+def decode_step(body: list) -> StepType:
+    step_type = body[0]
+    if step_type == BaseUpdateType.type:
+        return BaseUpdateType(body[1], body[2])
+
+    step_class = steps_data_registry.get(step_type)
+    if step_class is None:
+        raise ValueError(f"Unknown step type: {step_type}")
+
+    name, message, values, extra = body[1:]
+    data = dict(zip(step_class.data_keys, values))
+    if extra:
+        data.update(extra)
+    return step_class(name, decode_message(message), data)
+
+def encode_steps(steps: list[StepType]) -> bytes:
+    return dumps([encode_step(step) for step in steps])
+
+def decode_steps(raw: bytes) -> list[StepType]:
+    return [decode_step(body) for body in loads(raw)]
+
+
+# Данные обработчика (BaseStateHandler.get_data) - словарь как есть
+
+def encode_state(data: dict) -> bytes:
+    return dumps(data)
+
+def decode_state(raw: bytes) -> dict:
+    return loads(raw)
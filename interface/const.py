@@ -1,3 +1,6 @@
 BACK_BUTTON = "◀"
 FORWARD_BUTTON = "▶"
-CANCEL_BUTTON = "❌ Отмена"
\ No newline at end of file
+CANCEL_BUTTON = "❌ Отмена"
+
+# Сколько шагов обновления (BaseUpdateType) next_step выполнит подряд за один переход
+MAX_UPDATE_HOPS = 100
@@ -0,0 +1,201 @@
+import copy
+import hashlib
+import json
+from collections import Counter, OrderedDict
+from os import getenv
+from typing import Any, Optional, Union
+
+from bot.main import STORAGE
+from interface.codec import decode_steps, encode_steps
+from interface.option_index import store_index
+from interface.steps_datatype import BaseDataType, BaseUpdateType, get_step_data, steps_data_registry
+from interface.tracing import end_trace
+
+
+StepType = Union[BaseDataType, BaseUpdateType]
+
+
+def plan_hash(raw_steps: Union[list[dict], dict]) -> str:
+    """ Хэш содержимого шагов, используется как id плана (и id шага).
+    """
+    dump = json.dumps(raw_steps, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+class InternedStep():
+    """ Общий для всех планов шаг и его данные обработчика
+    """
+
+    __slots__ = ('step', 'handler_data')
+
+    def __init__(self, step: StepType, step_id: str):
+        self.step: StepType = step
+        self.handler_data: dict = step.to_handler_data()
+
+        # Индекс вариантов строится один раз на шаг, в состояние попадает только его id
+        options = self.handler_data.get('options')
+        if isinstance(options, dict) and not self.handler_data.get('options_provider'):
+            self.handler_data['options_id'] = store_index(options, step_id)
+
+
+# Одинаковые шаги разных планов - один объект (LRU: планы держат свои шаги сами,
+# вытесненный шаг при следующей компиляции разбирается заново)
+interned_steps: OrderedDict[str, InternedStep] = OrderedDict()
+interned_steps_size = int(getenv('CSS_STEP_CACHE_SIZE', 8192))
+
+def compile_step(raw_step: dict) -> StepType:
+    """ Превращает словарь шага (из to_dict) в объект шага.
+    """
+    if raw_step['type'] in steps_data_registry and raw_step['type'] != BaseUpdateType.type:
+        return get_step_data(**copy.deepcopy(raw_step))
+
+    new_step: dict = copy.deepcopy(raw_step)
+    new_step.pop('type', None)
+    return BaseUpdateType(**new_step)
+
+def intern_step(raw_step: dict) -> InternedStep:
+    """ Компилирует шаг или возвращает уже скомпилированный шаг с тем же содержимым.
+    """
+    step_id = plan_hash(raw_step)
+
+    interned = interned_steps.get(step_id)
+    if interned is None:
+        interned = interned_steps[step_id] = InternedStep(compile_step(raw_step), step_id)
+        if len(interned_steps) > interned_steps_size:
+            interned_steps.popitem(last=False)
+    else:
+        interned_steps.move_to_end(step_id)
+    return interned
+
+
+class ConveyorPlan():
+    """
+    Скомпилированный план конвейера.
+    Шаги разбираются один раз при создании плана и общие для всех планов (interned_steps),
+    в состоянии пользователя хранится только id плана, process и ответы.
+    """
+
+    def __init__(self, plan_id: str, raw_steps: list[dict]):
+        self.plan_id: str = plan_id
+        self.raw_steps: list[dict] = raw_steps
+
+        interned = [intern_step(raw) for raw in raw_steps]
+        self.steps: list[StepType] = [i.step for i in interned]
+        self.handler_data: list[dict] = [i.handler_data for i in interned]
+        self.stored: bool = False
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def steps_view(self) -> list[dict]:
+        """ Копии словарей шагов для функций обновления (transmitted_data['steps'])
+        """
+        return copy.deepcopy(self.raw_steps)
+
+    def get_handler_data(self, process: int) -> dict:
+        """ Данные для обработчика шага.
+            Копируется только верхний уровень: options, pages и т.п. - общие объекты
+            для всех пользователей плана, изменять их можно только заменой (копия при записи).
+        """
+        return dict(self.handler_data[process])
+
+
+# Реестр скомпилированных планов процесса (LRU). Вытесненный план подгружается
+# через load_plan: из хранилища (set_plan) или из plan_archive
+conveyor_plans: OrderedDict[str, ConveyorPlan] = OrderedDict()
+conveyor_plans_size = int(getenv('CSS_PLAN_CACHE_SIZE', 1024))
+
+# Закодированные планы для хранилищ без set_plan (memory): план_id -> bytes кодека.
+# Хранятся, пока план используют конвейеры процесса (plan_sessions)
+plan_archive: dict[str, bytes] = {}
+plan_sessions: Counter = Counter()
+
+def remember_plan(plan: ConveyorPlan) -> None:
+    conveyor_plans[plan.plan_id] = plan
+    conveyor_plans.move_to_end(plan.plan_id)
+    if len(conveyor_plans) > conveyor_plans_size:
+        conveyor_plans.popitem(last=False)
+
+def compile_plan(steps: list[Union[StepType, dict]]) -> ConveyorPlan:
+    """ Компилирует шаги в план или возвращает уже существующий план с тем же содержимым.
+    """
+    raw_steps = [step if isinstance(step, dict) else step.to_dict() for step in steps]
+    plan_id = plan_hash(raw_steps)
+
+    plan = conveyor_plans.get(plan_id)
+    if plan is None:
+        plan = ConveyorPlan(plan_id, raw_steps)
+    remember_plan(plan)
+    return plan
+
+def get_plan(plan_id: str) -> ConveyorPlan:
+    """ Получение плана по id.
+    """
+    plan = conveyor_plans.get(plan_id)
+    if plan is None:
+        raise KeyError(f"План конвейера '{plan_id}' не найден")
+    return plan
+
+async def store_plan(plan: ConveyorPlan) -> None:
+    """ Сохраняет план в хранилище, если оно это поддерживает (план переживёт перезапуск).
+    """
+    if plan.stored:
+        return
+    if hasattr(STORAGE, 'set_plan'):
+        await STORAGE.set_plan(plan.plan_id, encode_steps(plan.steps))
+    else:
+        plan_archive[plan.plan_id] = encode_steps(plan.steps)
+    plan.stored = True
+
+async def load_plan(plan_id: str) -> ConveyorPlan:
+    """ Получение плана по id, с подгрузкой из хранилища после перезапуска.
+    """
+    plan = conveyor_plans.get(plan_id)
+    if plan is not None:
+        conveyor_plans.move_to_end(plan_id)
+        return plan
+
+    raw_steps: Optional[Union[bytes, list]] = plan_archive.get(plan_id)
+    if raw_steps is None and hasattr(STORAGE, 'get_plan'):
+        raw_steps = await STORAGE.get_plan(plan_id)
+    if isinstance(raw_steps, bytes):
+        raw_steps = [step.to_dict() for step in decode_steps(raw_steps)]
+    if raw_steps is not None:
+        plan = ConveyorPlan(plan_id, raw_steps)
+        plan.stored = True
+        remember_plan(plan)
+
+    return get_plan(plan_id)
+
+
+def acquire_plan(plan_id: str) -> None:
+    """ Конвейер начал использовать план
+    """
+    plan_sessions[plan_id] += 1
+
+def release_plan(plan_id: Optional[str]) -> None:
+    """ Конвейер завершён или истёк: план без конвейеров удаляется из plan_archive
+    """
+    if plan_id is None:
+        return
+    plan_sessions[plan_id] -= 1
+    if plan_sessions[plan_id] <= 0:
+        del plan_sessions[plan_id]
+        plan_archive.pop(plan_id, None)
+
+def close_conveyor(conveyor_data: dict, userid: Any, outcome: str) -> None:
+    """ Общее завершение конвейера (finished / expired / cancelled):
+        span конвейера и освобождение плана
+    """
+    end_trace(conveyor_data.get('trace'), userid, conveyor_data.get('process'), outcome)
+    release_plan(conveyor_data.get('plan'))
+
+
+def set_step_value(transmitted_data: dict, key: str, value: Any) -> None:
+    """ Записывает служебное значение (id сообщений) для текущего шага КСС,
+        либо в сам transmitted_data, если состояние запущено вне КСС.
+    """
+    if 'plan' in transmitted_data and 'process' in transmitted_data:
+        transmitted_data.setdefault('step_state', {})[key] = value
+    else:
+        transmitted_data[key] = value
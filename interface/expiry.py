@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import time
+from os import getenv
+from typing import Optional
+
+from aiogram.fsm.context import FSMContext
+
+from interface.conveyor import close_conveyor
+from interface.locks import user_locks
+from interface.metrics import metrics
+from interface.utils import call_callback, get_state
+
+
+# TTL состояния по умолчанию в секундах, 0 - без ограничения
+default_ttl: int = int(getenv('CSS_STATE_TTL', 0))
+
+
+class ExpiryIndex():
+    """
+    Упорядоченный по времени индекс сроков жизни состояний.
+    Ключ - (chat_id, user_id). Куча хранит (expires_at, key),
+    устаревшие записи (после переноса срока) пропускаются при извлечении,
+    поэтому проверка стоит O(истёкших), а не O(всех пользователей).
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[int, tuple]] = []
+        self.deadlines: dict[tuple, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def schedule(self, key: tuple, expires_at: int) -> None:
+        if self.deadlines.get(key) == expires_at:
+            return
+
+        self.deadlines[key] = expires_at
+        heapq.heappush(self.heap, (expires_at, key))
+
+        if len(self.heap) > 2 * len(self.deadlines) + 1024:
+            # Слишком много устаревших записей - пересобираем кучу
+            self.heap = [(value, key) for key, value in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def discard(self, key: tuple) -> None:
+        self.deadlines.pop(key, None)
+
+    def pop_expired(self, now: float) -> list[tuple]:
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self.heap)
+            if self.deadlines.get(key) == expires_at:
+                del self.deadlines[key]
+                expired.append(key)
+        return expired
+
+
+async def expire_if_needed(state: FSMContext, data: dict,
+                           now: Optional[float] = None) -> bool:
+    """ Если срок состояния истёк - очищает его и вызывает on_expire.
+        Возвращает True, если состояние удалено.
+    """
+    expires_at = data.get('expires_at')
+    if not expires_at:
+        return False
+
+    if expires_at > (now or time.time()):
+        # Срок перенесли (например, в другом процессе) - следим за новым
+        expiry_index.schedule((state.key.chat_id, state.key.user_id), expires_at)
+        return False
+
+    await state.clear()
+    metrics.inc('css_states_expired_total')
+    conveyor_data = data.get('transmitted_data') or {}
+    close_conveyor(conveyor_data, data.get('userid'), 'expired')
+
+    on_expire = data.get('on_expire')
+    if on_expire:
+        transmitted_data = dict(data.get('transmitted_data') or {})
+        transmitted_data.update(
+            {
+                'userid': data.get('userid'),
+                'chatid': data.get('chatid'),
+                'lang': data.get('lang')
+            }
+        )
+        try:
+            await call_callback(on_expire, transmitted_data)
+        except Exception as e:
+            metrics.inc('css_errors_total', where='on_expire')
+            print(f'on_expire error {on_expire}: {e}')
+    return True
+
+
+class ExpirySweeper():
+    """
+    Фоновая задача, раз в interval секунд удаляющая истёкшие состояния из индекса.
+    Индекс живёт в памяти процесса: после перезапуска истёкшее состояние
+    удаляется при следующем сообщении пользователя (UserLockMiddleware).
+    """
+
+    def __init__(self, index: ExpiryIndex, interval: float = 1.0):
+        self.index: ExpiryIndex = index
+        self.interval: float = interval
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """ Запускает проверку в текущем цикле событий (вызывается автоматически)
+        """
+        if self.task is not None and not self.task.done():
+            return
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                metrics.inc('css_errors_total', where='expiry_sweep')
+                print(f'ExpirySweeper error {e}')
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """ Удаляет истёкшие состояния, возвращает их количество
+        """
+        now = now or time.time()
+        expired = 0
+
+        for key in self.index.pop_expired(now):
+            chat_id, user_id = key
+            async with user_locks(key):
+                state = get_state(user_id, chat_id)
+                if await expire_if_needed(state, await state.get_data(), now):
+                    expired += 1
+        return expired
+
+
+expiry_index = ExpiryIndex()
+expiry_sweeper = ExpirySweeper(expiry_index, float(getenv('CSS_EXPIRY_INTERVAL', 1)))
+
+def track_expiry(chat_id: int, user_id: int, expires_at: Optional[int]) -> None:
+    """ Добавляет срок состояния в индекс и запускает проверку
+    """
+    if not expires_at:
+        return
+    expiry_index.schedule((chat_id, user_id), expires_at)
+    expiry_sweeper.start()
@@ -0,0 +1,150 @@
+import asyncio
+import atexit
+import json
+import os
+from collections import OrderedDict
+from os import getenv
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from interface.metrics import metrics
+from interface.scheduler import scheduled_bot as bot
+
+
+# Ошибки Telegram о недействительном file_id - только после них запись удаляется
+FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier',
+                  'file reference', 'file_reference')
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    text = str(error.message).lower()
+    return any(i in text for i in FILE_ID_ERRORS)
+
+
+class FileIdCache():
+    """
+    Кэш file_id загруженных в Telegram фото.
+    Ключ - путь к файлу + mtime + размер, поэтому изменённый файл загрузится заново.
+    Хранит не больше max_size записей, при указании path сохраняет их на диск (json).
+    Запись одна фоновая задача: изменения за save_delay секунд пишутся одним снимком,
+    записи не пересекаются.
+    """
+
+    def __init__(self, max_size: int = 1024, path: Optional[str] = None,
+                 save_delay: float = 1.0):
+        self.max_size: int = max_size
+        self.path: Optional[str] = path
+        self.save_delay: float = save_delay
+        self.items: OrderedDict[str, str] = OrderedDict()
+
+        self.dirty: bool = False
+        self._writer: Optional[asyncio.Task] = None
+
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.items.update(json.load(f))
+
+    @staticmethod
+    def key(file_path: str) -> Optional[str]:
+        """ Ключ файла, None - если это не локальный файл (url или file_id)
+        """
+        try:
+            stat = os.stat(file_path)
+        except (OSError, ValueError):
+            return None
+        return f"{os.path.abspath(file_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def get(self, key: str) -> Optional[str]:
+        file_id = self.items.get(key)
+        if file_id:
+            self.items.move_to_end(key)
+        return file_id
+
+    def set(self, key: str, file_id: str) -> None:
+        self.items[key] = file_id
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+        self.save()
+
+    def delete(self, key: str) -> None:
+        if self.items.pop(key, None):
+            self.save()
+
+    def save(self) -> None:
+        """ Отмечает кэш изменённым, запись - в фоновой задаче (без цикла событий - сразу)
+        """
+        if not self.path:
+            return
+
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_loop())
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.dirty:
+            await asyncio.sleep(self.save_delay)
+            self.dirty = False
+            try:
+                await loop.run_in_executor(None, self._write, dict(self.items))
+            except Exception as e:
+                metrics.inc('css_errors_total', where='file_cache_write')
+                print(f'File id cache write error {e}')
+
+    def flush(self) -> None:
+        """ Синхронная запись несохранённых изменений (при выходе)
+        """
+        if not self.path or not self.dirty:
+            return
+        self.dirty = False
+        try:
+            self._write(dict(self.items))
+        except Exception as e:
+            metrics.inc('css_errors_total', where='file_cache_write')
+            print(f'File id cache write error {e}')
+
+    def _write(self, snapshot: dict) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+file_id_cache = FileIdCache(
+    max_size=int(getenv('CSS_FILE_CACHE_SIZE', 1024)),
+    path=getenv('CSS_FILE_CACHE_PATH')
+)
+if file_id_cache.path:
+    atexit.register(file_id_cache.flush)
+
+async def send_photo(chat_id: int, image: str, **kwargs) -> Message:
+    """ Отправка фото по пути: первый раз файл загружается,
+        дальше отправляется по сохранённому file_id.
+    """
+    key = file_id_cache.key(image)
+    if key is None:
+        return await bot.send_photo(chat_id, image, **kwargs)
+
+    file_id = file_id_cache.get(key)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, file_id, **kwargs)
+        except TelegramBadRequest as e:
+            # Другие ошибки (подпись, разметка, чат) повторятся и при загрузке файла
+            if not is_file_id_error(e):
+                raise
+            # file_id больше не действителен - загружаем заново
+            file_id_cache.delete(key)
+
+    res = await bot.send_photo(chat_id, FSInputFile(image), **kwargs)
+    if res.photo:
+        file_id_cache.set(key, res.photo[-1].file_id)
+    return res
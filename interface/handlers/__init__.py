@@ -3,7 +3,8 @@ from pathlib import Path
 
 current_dir = Path(__file__).parent
 
-for file in current_dir.glob('*.py'):
+# commands - первыми: отмена должна срабатывать раньше обработчиков состояний
+for file in sorted(current_dir.glob('*.py'), key=lambda file: file.stem != 'commands'):
     if file.name != '__init__.py':
         module_name = file.stem
         importlib.import_module(f'.{module_name}', package=__name__)
\ No newline at end of file
@@ -1,26 +1,42 @@
-from bot.main import botik as bot, css_router
+from typing import Optional
+
+from bot.main import css_router
+from interface.conveyor import close_conveyor
+from interface.metrics import metrics
+from interface.scheduler import scheduled_bot as bot
 from interface.utils import get_state
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram import F
 
-async def cancel(message, text:str = "❌"):
+async def cancel(message, text:str = "❌", state_data: Optional[dict] = None):
     """ Команда общей отмены
+        state_data - данные состояния, если уже прочитаны (UserLockMiddleware)
     """
     if text:
         await bot.send_message(message.chat.id, text)
 
     state = get_state(message.from_user.id, message.chat.id)
-    if state: await state.clear()
+    if not state: return
+
+    if state_data is None:
+        state_data = await state.get_data()
+    await state.clear()
+
+    # Запущенный конвейер: span cancelled и освобождение плана
+    conveyor_data = state_data.get('transmitted_data') or {}
+    if 'process' in conveyor_data:
+        close_conveyor(conveyor_data, state_data.get('userid'), 'cancelled')
+        metrics.inc('css_conveyor_cancelled_total')
 
 @css_router.message(F.containst('❌'))
-async def cancel_m(message: Message):
+async def cancel_m(message: Message, state_data: Optional[dict] = None):
     """ Команда отмены
     """
-    await cancel(message)
+    await cancel(message, state_data=state_data)
 
 @css_router.message(Command(commands=['cancel']))
-async def cancel_c(message: Message):
+async def cancel_c(message: Message, state_data: Optional[dict] = None):
     """ Команда отмены
     """
-    await cancel(message)
\ No newline at end of file
+    await cancel(message, state_data=state_data)
@@ -1,13 +1,14 @@
 from aiogram import F
-from bot.main import botik as bot, css_router
+from bot.main import css_router
+from interface.scheduler import scheduled_bot as bot
 from interface.state_handlers import ChooseImageHandler
 from interface.states import GeneralStates
+from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 
-from interface.utils import get_state
 
 @css_router.message(F.photo, GeneralStates.ChooseImage)
-async def ChooseImage(message: Message):
+async def ChooseImage(message: Message, state: FSMContext, state_data: dict):
     """Общая функция для получения изображения
     """
     if not message.from_user or not message.from_user.id:
@@ -18,13 +19,11 @@ async def ChooseImage(message: Message):
                                )
         return
 
-    userid = message.from_user.id
-    state = get_state(userid, message.chat.id)
-
-    if state and (data := await state.get_data()):
+    if data := state_data:
         transmitted_data = data.get('transmitted_data', {})
+        handler = ChooseImageHandler(**data)
 
-        await state.clear()
+        await handler.leave_state(state)
 
         if message.photo:
             fileID = message.photo[-1].file_id
@@ -36,21 +35,21 @@ async def ChooseImage(message: Message):
                                )
             return
 
-        await ChooseImageHandler(**data).call_function(fileID)
+        await handler.call_function(fileID)
 
 @css_router.message(GeneralStates.ChooseImage)
-async def ChooseImage_0(message: Message):
+async def ChooseImage_0(message: Message, state: FSMContext, state_data: dict):
     """Общая функция для получения изображения
     """
 
-    state = get_state(message.from_user.id, message.chat.id)
     if message.text == '0':
-        if data := await state.get_data():
+        if data := state_data:
             need_image = data['need_image']
 
         if need_image:
-            await state.clear()
+            handler = ChooseImageHandler(**data)
+            await handler.leave_state(state)
 
-            await ChooseImageHandler(**data).call_function('no_image')
+            await handler.call_function('no_image')
 
 
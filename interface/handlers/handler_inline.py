@@ -3,19 +3,22 @@ from bot.main import css_router
 from interface.handlers.commands import cancel
 from interface.state_handlers import ChooseConfirmHandler, ChooseInlineHandler
 from interface.states import GeneralStates
+from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery
 
-from interface.utils import get_state
+from interface.conveyor import set_step_value
+from interface.metrics import metrics
+from interface.option_index import resolve_inline
 
 @css_router.callback_query(GeneralStates.ChooseInline, F.data.startswith('chooseinline'))
-async def ChooseInline(callback: CallbackQuery):
+async def ChooseInline(callback: CallbackQuery, state: FSMContext, state_data: dict):
     """
     chooseinline <custom_code> <data>
+    chooseinline <custom_code> #<номер> - для inline_options (данные в callback_map состояния)
     """
     code = callback.data.split()
 
-    state = get_state(callback.from_user.id, callback.message.chat.id)
-    if data := await state.get_data():
+    if data := state_data:
         if not data:
             return
 
@@ -31,20 +34,19 @@ async def ChooseInline(callback: CallbackQuery):
         code.pop(0)
         if len(code) == 1: code = code[0]
 
+        found, code = resolve_inline(code, data.get('callback_map'))
+        if not found: return
+
         transmitted_data['temp'] = {}
         transmitted_data['temp']['message_data'] = callback.message
 
-        if 'steps' in transmitted_data and 'process' in transmitted_data:
-            try:
-                transmitted_data['steps'][transmitted_data['process']]['bmessageid'] = callback.message.message_id
-            except Exception as e:
-                print(f'ChooseInline error {e}')
-
-        else: transmitted_data['bmessageid'] = callback.message.message_id
+        set_step_value(transmitted_data, 'bmessageid', callback.message.message_id)
 
-        if data['one_element']: await state.clear()
+        handler = ChooseInlineHandler(**data)
+        if data['one_element']: await handler.leave_state(state)
 
         try:
-            await ChooseInlineHandler(**data).call_function(code)
+            await handler.call_function(code)
         except Exception as e:
-                print(f'ChooseInline call_function error {e}')
+            metrics.inc('css_errors_total', where='inline_call_function')
+            print(f'ChooseInline call_function error {e}')
@@ -1,62 +1,82 @@
-from bot.main import botik as bot, css_router
+from bot.main import css_router
+from interface.scheduler import scheduled_bot as bot
 from interface.const import BACK_BUTTON, FORWARD_BUTTON
 from interface.state_handlers import ChoosePagesStateHandler
 from interface.states import GeneralStates
+from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 
-from interface.utils import chunk_pages, get_state
+from interface.conveyor import set_step_value
+from interface.option_index import match_option
+from interface.side_effects import run_in_background
 
 
+async def load_page(handler: ChoosePagesStateHandler, state: FSMContext, page: int):
+    """Загружает страницу из options_provider и сохраняет её в состояние
+    """
+    await handler.load_page(page)
+    await state.update_data(options=handler.options, page=handler.page,
+                            pages_count=handler.pages_count)
+    return handler.current_pages()
 
 @css_router.message(GeneralStates.ChoosePagesState)
-async def ChooseOptionPages(message: Message):
+async def ChooseOptionPages(message: Message, state: FSMContext, state_data: dict):
     """Кастомный обработчик, принимает данные и отправляет в обработчик
     """
     chatid = message.chat.id
 
-    state = get_state(message.from_user.id, message.chat.id)
-    if data := await state.get_data():
+    if data := state_data:
         options: dict = data['options']
         transmitted_data: dict = data['transmitted_data']
 
-        pages: list = data['pages']
         page: int = data['page']
         one_element: bool = data['one_element']
 
-        settings: dict = data['settings']
         lang: str = data['lang']
 
     handler = ChoosePagesStateHandler(**data)
+    pages = handler.current_pages()
+
+    # Точно, без учёта регистра и пробелов или (match_prefix) по началу текста
+    key = match_option(options, message.text, handler.match_prefix, handler.options_id)
 
-    if message.text in options.keys():
-        if one_element: await state.clear()
+    if key is not None:
+        if one_element: await handler.leave_state(state)
 
-        transmitted_data['options'] = options
-        transmitted_data['key'] = message.text
+        # options может быть общим для всех пользователей плана - функции отдаётся копия
+        transmitted_data['options'] = dict(options)
+        transmitted_data['key'] = key
 
-        if 'steps' in transmitted_data and 'process' in transmitted_data:
-            transmitted_data['steps'][transmitted_data['process']]['umessageid'] = message.message_id
-        else: transmitted_data['umessageid'] = message.message_id
+        set_step_value(transmitted_data, 'umessageid', message.message_id)
 
-        res = await ChoosePagesStateHandler(**data).call_function(options[message.text])
+        res = await handler.call_function(options[key])
 
         if not one_element and res and type(res) == dict and 'status' in res:
             # Удаляем состояние
             if res['status'] == 'reset': await state.clear()
 
+            # Данные отдаёт options_provider - перечитываем страницу
+            elif res['status'] in ('update', 'edit') and handler.options_provider:
+                pages = await load_page(handler, state, res.get('page', page))
+                await handler.call_update_page_function(pages, handler.page, chatid, lang)
+
             # Обновить все данные
             elif res['status'] == 'update' and 'options' in res:
-                pages = chunk_pages(res['options'], settings['horizontal'], settings['vertical'])
+                handler.set_options(res['options'])
+                pages = handler.make_pages(handler.options)
 
                 if 'page' in res: page = res['page']
                 if page >= len(pages) - 1: page = 0
 
-                await state.update_data(options=res['options'], pages=pages, page=page)
+                await state.update_data(options=handler.options, options_id=handler.options_id, page=page,
+                                        **({} if handler.page_view else {'pages': pages}))
                 await handler.call_update_page_function(pages, page, chatid, lang)
 
             # Добавить или удалить элемент
             elif res['status'] == 'edit' and 'elements' in res:
-                
+                # options может быть общим для всех пользователей плана - меняем копию
+                options = dict(options)
+
                 for key, value in res['elements'].items():
                     if key == 'add':
                         for iter_key, iter_value in value.items():
@@ -64,11 +84,13 @@ async def ChooseOptionPages(message: Message):
                     elif key == 'delete':
                         for i in value: del options[i]
 
-                pages = chunk_pages(options, settings['horizontal'], settings['vertical'])
+                handler.set_options(options)
+                pages = handler.make_pages(options)
 
                 if page >= len(pages) - 1: page = 0
 
-                await state.update_data(options=options, pages=pages, page=page)
+                await state.update_data(options=options, options_id=handler.options_id, page=page,
+                                        **({} if handler.page_view else {'pages': pages}))
                 await handler.call_update_page_function(pages, page, chatid, lang)
 
     elif message.text == BACK_BUTTON and len(pages) > 1:
@@ -76,15 +98,17 @@ async def ChooseOptionPages(message: Message):
         else: page -= 1
 
         if data.get('last_user_message'):
-            await bot.delete_message(chatid, data['last_user_message'])
+            run_in_background(bot.delete_message(chatid, data['last_user_message']))
 
-        await state.update_data(page=page)
+        if handler.options_provider:
+            pages = await load_page(handler, state, page)
+        else: await state.update_data(page=page)
         mes = await handler.call_update_page_function(pages, page, chatid, lang)
         if isinstance(mes, Message):
             mes_id = mes.message_id
 
             if data.get('last_updated_message'):
-                await bot.delete_message(chatid, data['last_updated_message'])
+                run_in_background(bot.delete_message(chatid, data['last_updated_message']))
 
             await state.update_data(last_updated_message=mes_id, last_user_message=message.message_id)
 
@@ -93,15 +117,17 @@ async def ChooseOptionPages(message: Message):
         else: page += 1
 
         if data.get('last_user_message'):
-            await bot.delete_message(chatid, data['last_user_message'])
+            run_in_background(bot.delete_message(chatid, data['last_user_message']))
 
-        await state.update_data(page=page)
+        if handler.options_provider:
+            pages = await load_page(handler, state, page)
+        else: await state.update_data(page=page)
         mes = await handler.call_update_page_function(pages, page, chatid, lang)
         if isinstance(mes, Message):
             mes_id = mes.message_id
             
             if data.get('last_updated_message'):
-                await bot.delete_message(chatid, data['last_updated_message'])
+                run_in_background(bot.delete_message(chatid, data['last_updated_message']))
 
             await state.update_data(last_updated_message=mes_id, last_user_message=message.message_id)
     else:
@@ -0,0 +1,83 @@
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from bot.main import css_router
+from interface.expiry import expire_if_needed
+from interface.locks import user_locks
+from interface.tracing import begin_update, end_update, update_started
+
+
+async def read_state(state: FSMContext) -> tuple[Optional[str], dict]:
+    """ Состояние и данные: одним запросом, если хранилище это умеет
+    """
+    storage = state.storage
+    if hasattr(storage, 'get_state_data'):
+        return await storage.get_state_data(state.key)
+    return await state.get_state(), await state.get_data()
+
+def event_key(event: TelegramObject) -> Optional[tuple]:
+    """ (chat_id, user_id) события - тот же ключ, что у состояния в get_state
+    """
+    if isinstance(event, Message):
+        return event.chat.id, event.from_user.id if event.from_user else None
+    if isinstance(event, CallbackQuery) and event.message:
+        return event.message.chat.id, event.from_user.id
+    return None
+
+
+class UserLockMiddleware(BaseMiddleware):
+    """
+    Обновления одного пользователя проходят обработчики КСС по очереди:
+    get_data -> изменение -> clear/update_data не перемешиваются
+    при параллельной обработке обновлений.
+
+    Под блокировкой состояние и его данные читаются одним обращением (get_state_data)
+    и передаются обработчикам как raw_state, state (FSMContext) и state_data (dict),
+    без повторного get_state/get_data.
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        key = event_key(event)
+        if key is None:
+            await self.load_state(data)
+            return await handler(event, data)
+
+        trace = begin_update()
+        if trace is None:
+            async with user_locks(key):
+                await self.load_state(data)
+                return await handler(event, data)
+
+        try:
+            async with user_locks(key):
+                update_started(trace)
+                await self.load_state(data)
+                return await handler(event, data)
+        finally:
+            end_update(trace)
+
+    @staticmethod
+    async def load_state(data: dict[str, Any]) -> None:
+        data['state_data'] = {}
+        if (state := data.get('state')) is None:
+            return
+
+        # raw_state прочитан диспетчером до блокировки - перечитываем под ней
+        data['raw_state'], state_data = await read_state(state)
+        if data['raw_state'] is None:
+            return
+
+        # Истёкшее состояние (если проверка ещё не успела его удалить)
+        if await expire_if_needed(state, state_data):
+            data['raw_state'] = None
+        else:
+            data['state_data'] = state_data
+
+
+# outer - блокировка берётся до проверки фильтра состояния
+css_router.message.outer_middleware(UserLockMiddleware())
+css_router.callback_query.outer_middleware(UserLockMiddleware())
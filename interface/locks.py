@@ -0,0 +1,68 @@
+import asyncio
+from collections import deque
+from typing import Hashable, Optional
+
+
+class KeyedLock():
+    """
+    Асинхронная блокировка по ключу (пользователю).
+    Без конкуренции захват - одна запись в словарь, без создания asyncio.Lock и без await.
+    Ожидающие получают блокировку строго в порядке очереди (FIFO).
+    """
+
+    def __init__(self):
+        # key -> очередь ожидающих (None - захвачено, очереди нет)
+        self.owners: dict[Hashable, Optional[deque]] = {}
+
+    def locked(self, key: Hashable) -> bool:
+        return key in self.owners
+
+    async def acquire(self, key: Hashable) -> None:
+        if key not in self.owners:
+            self.owners[key] = None
+            return
+
+        waiters = self.owners[key]
+        if waiters is None:
+            waiters = self.owners[key] = deque()
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Блокировка уже передана нам - отдаём следующему
+                self.release(key)
+            raise
+
+    def release(self, key: Hashable) -> None:
+        waiters = self.owners[key]
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                # Передаём владение напрямую, ключ остаётся захваченным
+                future.set_result(None)
+                return
+        del self.owners[key]
+
+    def __call__(self, key: Hashable) -> '_KeyedLockContext':
+        return _KeyedLockContext(self, key)
+
+
+class _KeyedLockContext():
+    __slots__ = ('lock', 'key')
+
+    def __init__(self, lock: KeyedLock, key: Hashable):
+        self.lock = lock
+        self.key = key
+
+    async def __aenter__(self) -> None:
+        await self.lock.acquire(self.key)
+
+    async def __aexit__(self, *args) -> None:
+        self.lock.release(self.key)
+
+
+# Блокировка переходов КСС по (chat_id, user_id)
+user_locks = KeyedLock()
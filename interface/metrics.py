@@ -0,0 +1,225 @@
+import time
+from bisect import bisect_left
+from os import getenv
+from typing import Any, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.main import STORAGE, botik, dp
+from interface.utils import callback_miss_hooks
+
+
+# Границы корзин гистограмм времени, секунды
+time_buckets: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                                   0.1, 0.25, 0.5, 1, 2.5, 5)
+
+LabelsKey = tuple[str, tuple[tuple[str, Any], ...]]
+
+
+class Histogram():
+    """ Гистограмма в формате Prometheus (накопительные корзины, сумма, количество)
+    """
+
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets: list[int] = [0] * len(time_buckets)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(time_buckets, value)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer():
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            self.registry.inc('css_errors_total', where=self.name)
+
+
+class _NullTimer():
+    """ Таймер выключенных метрик - ничего не делает
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class MetricsRegistry():
+    """
+    Реестр счётчиков и гистограмм процесса.
+    Пока метрики выключены, inc/observe ничего не пишут, а timer отдаёт пустой таймер,
+    обёртки хранилища и API не установлены.
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.counters: dict[LabelsKey, float] = {}
+        self.histograms: dict[LabelsKey, Histogram] = {}
+
+    @staticmethod
+    def key(name: str, labels: dict) -> LabelsKey:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def timer(self, name: str, **labels):
+        """ with metrics.timer('css_handler_setup_seconds', handler='int'): ...
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name, labels)
+
+    def get(self, name: str, **labels) -> float:
+        return self.counters.get(self.key(name, labels), 0)
+
+    def clear(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+
+    def render(self) -> str:
+        """ Текстовый формат Prometheus
+        """
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(time_buckets, histogram.buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsRequestMiddleware(BaseRequestMiddleware):
+    """ Время и исход каждого запроса к Telegram API
+    """
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            result = await make_request(bot, method)
+        except TelegramRetryAfter:
+            metrics.inc('css_api_requests_total', method=name, outcome='retry_after')
+            raise
+        except Exception:
+            metrics.inc('css_api_requests_total', method=name, outcome='error')
+            raise
+        finally:
+            metrics.observe('css_api_seconds', time.perf_counter() - start, method=name)
+
+        metrics.inc('css_api_requests_total', method=name, outcome='ok')
+        return result
+
+
+# Операции хранилища, время которых измеряется
+storage_methods = ('get_state', 'set_state', 'get_data', 'set_data',
+                   'update_data', 'update_fields')
+
+def instrument_storage(storage: Any) -> None:
+    """ Оборачивает методы экземпляра хранилища замером времени
+    """
+    for name in storage_methods:
+        method = getattr(storage, name, None)
+        if method is None:
+            continue
+
+        async def timed(*args, _name=name, _method=method, **kwargs):
+            with metrics.timer('css_storage_seconds', op=_name):
+                return await _method(*args, **kwargs)
+        setattr(storage, name, timed)
+
+def count_callback_miss(func_path: str) -> None:
+    metrics.inc('css_callback_import_total', path=func_path)
+
+
+async def metrics_handler(request) -> Any:
+    from aiohttp import web
+    return web.Response(text=metrics.render(), content_type='text/plain')
+
+async def start_metrics_server(host: str, port: int) -> None:
+    """ Отдельный HTTP сервер с /metrics
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Метрики: http://{host}:{port}/metrics")
+
+
+def enable_metrics(port: Optional[int] = None, host: str = '0.0.0.0') -> None:
+    """ Включает метрики: обёртки хранилища и API ставятся только здесь,
+        поэтому выключенные метрики ничего не стоят.
+    """
+    if metrics.enabled:
+        return
+    metrics.enabled = True
+
+    instrument_storage(STORAGE)
+    botik.session.middleware(MetricsRequestMiddleware())
+    callback_miss_hooks.append(count_callback_miss)
+
+    if port:
+        async def on_startup(*args, **kwargs):
+            await start_metrics_server(host, port)
+        dp.startup.register(on_startup)
+
+
+if getenv('CSS_METRICS'):
+    enable_metrics(int(getenv('CSS_METRICS_PORT', 0)) or None,
+                   getenv('CSS_METRICS_HOST', '0.0.0.0'))
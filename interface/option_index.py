@@ -0,0 +1,139 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Optional
+from uuid import uuid4
+
+from aiogram.types import InlineKeyboardMarkup
+
+from interface.utils import list_to_inline
+
+
+# Предел Telegram для callback_data (байты UTF-8)
+CALLBACK_DATA_LIMIT = 64
+
+# custom_code для inline_options, если шаг его не задал
+DEFAULT_INLINE_CODE = 'css'
+
+
+def normalize_option(text: str) -> str:
+    """ Текст варианта для нестрогого сравнения: без регистра и лишних пробелов
+    """
+    return ' '.join(text.split()).casefold()
+
+
+class OptionIndex():
+    """
+    Индекс ключей options: нормализованный текст -> ключ и отсортированные
+    нормализованные тексты для поиска по началу. Строится один раз на набор вариантов
+    (store_index), точное совпадение проверяется по самому options.
+    """
+
+    __slots__ = ('normal', 'sorted_normal')
+
+    def __init__(self, keys: tuple):
+        # Неоднозначные после нормализации тексты (None) не сопоставляются
+        self.normal: dict[str, Optional[Any]] = {}
+        for key in keys:
+            if not isinstance(key, str):
+                continue
+            norm = normalize_option(key)
+            self.normal[norm] = None if norm in self.normal else key
+
+        self.sorted_normal: list[str] = sorted(self.normal)
+
+    def find(self, text: str, prefix: bool = False) -> Optional[Any]:
+        """ Ключ для текста пользователя: нормализованное совпадение,
+            затем (prefix) единственный вариант, начинающийся с текста
+        """
+        norm = normalize_option(text)
+        if not norm:
+            return None
+
+        key = self.normal.get(norm)
+        if key is not None or not prefix or norm in self.normal:
+            return key
+
+        start = bisect_left(self.sorted_normal, norm)
+        candidates = [i for i in self.sorted_normal[start:start + 2] if i.startswith(norm)]
+        if len(candidates) != 1:
+            return None # Нет или больше одного варианта
+        return self.normal[candidates[0]]
+
+
+# id набора вариантов -> индекс. id хранится в состоянии (options_id): для шагов плана -
+# id шага (индекс строится при компиляции плана), для остальных - случайный при setup().
+# При вытеснении индекс перестраивается по options из состояния при следующем поиске
+option_indexes: OrderedDict[str, OptionIndex] = OrderedDict()
+option_indexes_size = int(getenv('CSS_OPTION_INDEXES', 4096))
+
+def store_index(options: dict, options_id: Optional[str] = None) -> str:
+    """ Строит (если его ещё нет) индекс options и возвращает его id
+    """
+    if options_id is None:
+        options_id = uuid4().hex
+    elif options_id in option_indexes:
+        option_indexes.move_to_end(options_id)
+        return options_id
+
+    option_indexes[options_id] = OptionIndex(tuple(options))
+    if len(option_indexes) > option_indexes_size:
+        option_indexes.popitem(last=False)
+    return options_id
+
+def option_index(options: dict, options_id: Optional[str] = None) -> OptionIndex:
+    """ Индекс options по id; без id (или после вытеснения) - строится заново
+    """
+    if options_id is None:
+        return OptionIndex(tuple(options))
+
+    index = option_indexes.get(options_id)
+    if index is None:
+        store_index(options, options_id)
+        index = option_indexes[options_id]
+    return index
+
+def match_option(options: dict, text: Optional[str], prefix: bool = False,
+                 options_id: Optional[str] = None) -> Optional[Any]:
+    """ Ключ options для текста пользователя или None.
+        Точное совпадение без индекса, иначе - без регистра и лишних пробелов,
+        с prefix - ещё и по единственному варианту с таким началом.
+        options_id - id индекса из store_index (для options из состояния).
+    """
+    if not text:
+        return None
+    if text in options:
+        return text
+    return option_index(options, options_id).find(text, prefix)
+
+
+# Inline: короткие id вместо данных в callback_data
+
+def inline_buttons(custom_code: str, inline_options: dict) -> list[dict]:
+    """ Кнопки для inline_options {"текст кнопки": данные}:
+        callback_data - 'chooseinline <custom_code> #<номер>', данные остаются в состоянии
+    """
+    buttons = []
+    for i, text in enumerate(inline_options):
+        callback_data = f'chooseinline {custom_code} #{i}'
+        if len(callback_data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {callback_data!r}")
+        buttons.append({'text': text, 'callback_data': callback_data})
+    return buttons
+
+def inline_markup(custom_code: str, inline_options: dict, row_width: int = 2) -> InlineKeyboardMarkup:
+    return list_to_inline(inline_buttons(custom_code, inline_options), row_width)
+
+def resolve_inline(code: Any, callback_map: Optional[list]) -> tuple[bool, Any]:
+    """ Данные кнопки по короткому id ('#<номер>').
+        Возвращает (найдено, данные); без callback_map код возвращается как есть.
+    """
+    if callback_map is None:
+        return True, code
+    if not isinstance(code, str) or not code.startswith('#') or not code[1:].isdecimal():
+        return False, None
+
+    i = int(code[1:])
+    if i >= len(callback_map):
+        return False, None
+    return True, callback_map[i]
@@ -0,0 +1,289 @@
+import asyncio
+import inspect
+import itertools
+from os import getenv
+from time import monotonic
+from typing import Any, Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.main import botik
+from interface.tracing import count_api_call
+
+
+# Полосы приоритета: меньше - раньше
+PROMPT = 0
+NORMAL = 1
+CLEANUP = 2
+
+# Приоритет методов API, остальные методы - PROMPT
+methods_priority: dict[str, int] = {
+    'edit_message_reply_markup': NORMAL,
+    'delete_message': CLEANUP,
+    'delete_messages': CLEANUP,
+}
+
+# Методы, у которых ожидающий вызов заменяется более новым для того же сообщения
+coalesce_methods: set[str] = {
+    'edit_message_text', 'edit_message_caption', 'edit_message_reply_markup'
+}
+
+
+class TokenBucket():
+    """
+    Корзина токенов: rate токенов в секунду, не больше capacity.
+    blocked_until - пауза после ответа 429 (retry_after).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = monotonic()
+        self.blocked_until: float = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """ Забирает токен и возвращает 0,
+            либо возвращает через сколько секунд токен появится.
+        """
+        now = monotonic()
+        self.refill(now)
+
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = monotonic()
+        self.refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class SendJob():
+    """ Один вызов API в очереди планировщика
+    """
+
+    __slots__ = ('chat_id', 'priority', 'seq', 'method', 'args', 'kwargs',
+                 'future', 'coalesce_key', 'attempts')
+
+    def __init__(self, chat_id: Any, priority: int, seq: int, method: Callable,
+                 args: tuple, kwargs: dict, future: asyncio.Future,
+                 coalesce_key: Optional[tuple] = None):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.coalesce_key = coalesce_key
+        self.attempts = 0
+
+    def __lt__(self, other: 'SendJob') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler():
+    """
+    Центральная очередь исходящих запросов к Telegram.
+    Ограничивает частоту запросов на чат и в целом (корзины токенов),
+    выполняет задачи по приоритету (PROMPT > NORMAL > CLEANUP),
+    схлопывает повторные edit одного сообщения и повторяет запрос после 429.
+    """
+
+    def __init__(self, chat_rate: float = 1, chat_burst: float = 5,
+                 global_rate: float = 30, global_burst: float = 30,
+                 workers: int = 8, max_retries: int = 3,
+                 max_buckets: int = 10_000):
+        self.chat_rate: float = chat_rate
+        self.chat_burst: float = chat_burst
+        self.global_bucket: TokenBucket = TokenBucket(global_rate, global_burst)
+        self.workers_count: int = workers
+        self.max_retries: int = max_retries
+        self.max_buckets: int = max_buckets
+
+        self.chat_buckets: dict[Any, TokenBucket] = {}
+        self.pending: dict[tuple, SendJob] = {}
+        self.seq = itertools.count()
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.workers: list[asyncio.Task] = []
+
+    def share_global(self, parts: int) -> None:
+        """ Общий лимит делится между parts процессами (bot/sharded.py):
+            каждому - своя доля частоты и запаса корзины
+        """
+        bucket = self.global_bucket
+        bucket.rate = bucket.rate / parts
+        bucket.capacity = max(1.0, bucket.capacity / parts)
+        bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    def start(self) -> None:
+        """ Запускает воркеров в текущем цикле событий (вызывается автоматически)
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+
+        self.loop = loop
+        self.queue = asyncio.PriorityQueue()
+        self.pending.clear()
+        self.workers = [loop.create_task(self._worker())
+                        for _ in range(self.workers_count)]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.loop = None
+
+    def chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.max_buckets:
+                # Полные корзины ничем не отличаются от новых
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items()
+                                     if not value.idle()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def call(self, chat_id: Any, method: Callable, /, *args,
+             priority: int = PROMPT, coalesce_key: Optional[tuple] = None,
+             **kwargs) -> asyncio.Future:
+        """ Ставит вызов method(*args, **kwargs) в очередь, возвращает future с результатом
+        """
+        self.start()
+
+        if coalesce_key is not None:
+            job = self.pending.get(coalesce_key)
+            if job is not None:
+                # Задача ещё не выполнялась - выполнится уже с новыми аргументами
+                job.method, job.args, job.kwargs = method, args, kwargs
+                return job.future
+
+        job = SendJob(chat_id, priority, next(self.seq), method, args, kwargs,
+                      self.loop.create_future(), coalesce_key)
+        if coalesce_key is not None:
+            self.pending[coalesce_key] = job
+
+        self.queue.put_nowait(job)
+        return job.future
+
+    def _requeue(self, job: SendJob) -> None:
+        self.queue.put_nowait(job)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.queue.get()
+
+            if job.future.done():
+                self._forget(job)
+                continue
+
+            # Вызовы без чата (chat_id=None) ограничены только общим лимитом
+            if job.chat_id is not None and (delay := self.chat_bucket(job.chat_id).take()):
+                # Чат ограничен - не занимаем воркера, вернём задачу позже
+                self.loop.call_later(delay, self._requeue, job)
+                continue
+
+            while delay := self.global_bucket.take():
+                await asyncio.sleep(delay)
+
+            self._forget(job)
+            await self._execute(job)
+
+    def _forget(self, job: SendJob) -> None:
+        if job.coalesce_key is not None and self.pending.get(job.coalesce_key) is job:
+            del self.pending[job.coalesce_key]
+
+    async def _execute(self, job: SendJob) -> None:
+        try:
+            result = await job.method(*job.args, **job.kwargs)
+
+        except TelegramRetryAfter as e:
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+
+            if job.chat_id is None:
+                # 429 без чата - ограничение всего бота
+                self.global_bucket.block(e.retry_after)
+            else:
+                self.chat_bucket(job.chat_id).block(e.retry_after)
+            self._requeue(job)
+
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+class ScheduledBot():
+    """
+    Обёртка над Bot: вызовы методов API идут через SendScheduler,
+    остальные атрибуты (id, session и т.д.) берутся у самого бота.
+    """
+
+    def __init__(self, bot: Bot, scheduler: SendScheduler):
+        self.bot: Bot = bot
+        self.scheduler: SendScheduler = scheduler
+        self.methods: dict[str, Callable] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.bot, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        method = self.methods.get(name)
+        if method is None:
+            method = self.methods[name] = self._make_method(name)
+        return method
+
+    def _make_method(self, name: str) -> Callable:
+        signature = inspect.signature(getattr(Bot, name))
+        priority = methods_priority.get(name, PROMPT)
+        coalesce = name in coalesce_methods
+
+        async def method(*args, **kwargs):
+            count_api_call()
+            arguments = signature.bind_partial(self.bot, *args, **kwargs).arguments
+            chat_id = arguments.get('chat_id')
+            coalesce_key = None
+            if coalesce and arguments.get('message_id') is not None:
+                coalesce_key = (name, chat_id, arguments['message_id'])
+
+            return await self.scheduler.call(
+                chat_id, getattr(self.bot, name), *args,
+                priority=priority, coalesce_key=coalesce_key, **kwargs
+            )
+
+        method.__name__ = name
+        return method
+
+
+send_scheduler = SendScheduler(
+    chat_rate=float(getenv('CSS_SEND_CHAT_RATE', 1)),
+    chat_burst=float(getenv('CSS_SEND_CHAT_BURST', 5)),
+    global_rate=float(getenv('CSS_SEND_GLOBAL_RATE', 30)),
+    global_burst=float(getenv('CSS_SEND_GLOBAL_BURST', 30)),
+    workers=int(getenv('CSS_SEND_WORKERS', 8))
+)
+scheduled_bot = ScheduledBot(botik, send_scheduler)
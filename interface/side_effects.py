@@ -0,0 +1,62 @@
+import asyncio
+from typing import Awaitable, Optional
+
+from interface.metrics import metrics
+
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks: set[asyncio.Task] = set()
+
+async def _run_deferred(coro: Awaitable) -> None:
+    try:
+        await coro
+    except Exception as e:
+        metrics.inc('css_errors_total', where='side_effects_deferred')
+        print(f'SideEffects deferred error {e}')
+
+def run_in_background(coro: Awaitable) -> asyncio.Task:
+    """ Запускает запрос в фоне, ошибки не прерывают переход
+    """
+    task = asyncio.ensure_future(_run_deferred(coro))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+class SideEffects():
+    """
+    Побочные вызовы API одного перехода.
+    Ограничение частоты запросов - в SendScheduler (interface/scheduler.py).
+    critical - выполняются параллельно и ожидаются в run(),
+    остальные (удаления сообщений) уходят в фон и не задерживают следующий шаг.
+    """
+
+    def __init__(self):
+        self.critical: list[Awaitable] = []
+        self.deferred: list[Awaitable] = []
+
+    def add(self, coro: Awaitable, critical: bool = False) -> None:
+        if critical:
+            self.critical.append(coro)
+        else:
+            self.deferred.append(coro)
+
+    async def run(self) -> Optional[list]:
+        for coro in self.deferred:
+            run_in_background(coro)
+        self.deferred = []
+
+        if not self.critical:
+            return None
+
+        results = await asyncio.gather(
+            *self.critical,
+            return_exceptions=True
+        )
+        self.critical = []
+
+        for result in results:
+            if isinstance(result, Exception):
+                metrics.inc('css_errors_total', where='side_effects')
+                print(f'SideEffects error {result}')
+        return results
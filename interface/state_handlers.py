@@ -1,17 +1,30 @@
-import inspect
 import time
 from typing import Any, Callable, Dict, List, Optional, Type, Union
 
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, Message
 from bson import Binary, Code, Decimal128, Int64, MaxKey, MinKey, ObjectId, Regex, Timestamp
 
-from bot.main import botik as bot
+from interface.scheduler import scheduled_bot as bot
+from interface.file_cache import send_photo
+from interface.side_effects import SideEffects
+from interface.const import MAX_UPDATE_HOPS
+from interface.conveyor import (
+    acquire_plan, close_conveyor, compile_plan, load_plan, release_plan, store_plan
+)
+from interface.expiry import default_ttl, track_expiry
+from interface.metrics import metrics
+from interface.option_index import DEFAULT_INLINE_CODE, inline_markup, store_index
+from interface.tracing import (
+    start_trace, step_answered, step_shown, update_step_done
+)
 from interface.steps_datatype import (
-    BaseDataType, BaseUpdateType, DataType, InlineStepData, StepMessage, get_step_data
+    BaseDataType, BaseUpdateType, DataType, InlineStepData, StepMessage
 )
 from interface.states import GeneralStates
-from interface.utils import chunk_pages, list_to_keyboard, down_menu, get_state, func_to_str, str_to_func, async_open
+from interface.tracking import TrackedDict, save_changes
+from interface.utils import PagesView, chunk_pages, list_to_keyboard, down_menu, get_state, func_to_str, call_callback
 
 
 states_to_str: dict[str, State] = {}
@@ -84,8 +97,11 @@ class BaseStateHandler():
                  transmitted_data: Optional[dict[str, BaseValueType]] = None,
                  message: Optional[StepMessage] = None,
                  messages_list: Optional[List[int]] = None,
+                 ttl: Optional[int] = None,
+                 on_expire: Optional[Callable | str] = None,
+                 validators: Optional[List[Callable | str]] = None,
                 #  end_process: bool = True
-                 ):
+                 **kwargs):
         if isinstance(function, str):
             self.function = function
         elif callable(function):
@@ -96,13 +112,25 @@ class BaseStateHandler():
         self.userid: int = userid
         self.chatid: int = chatid
         self.lang: str = lang
-        self.transmitted_data = transmitted_data or {}
+        # Тот же объект, что в данных состояния: обработчик можно создать до изменений
+        self.transmitted_data = transmitted_data if transmitted_data is not None else {}
 
         self.state_type = self.setState()
         self.message: Optional[StepMessage] = message
         self.messages_list: list[int] = messages_list or []
         # self.end_process: bool = end_process
 
+        # Время жизни состояния в секундах (None - CSS_STATE_TTL)
+        # и функция, вызываемая при истечении: on_expire(transmitted_data)
+        self.ttl: Optional[int] = ttl
+        self.on_expire: Optional[str] = func_to_str(on_expire) if callable(on_expire) else on_expire
+
+        # Дополнительные проверки ввода (interface/validators.py):
+        # validator(value, transmitted_data) -> текст ошибки или None
+        self.validators: Optional[list[str]] = [
+            func_to_str(i) if callable(i) else i for i in validators
+        ] if validators else None
+
     async def pre_data(self, value: Any) -> Any:
         """
         Предварительная обработка данных перед вызовом функции.
@@ -112,7 +140,6 @@ class BaseStateHandler():
 
     async def call_function(self, value: Any):
         value = await self.pre_data(value)
-        func = str_to_func(self.function)
 
         transmitted_data = self.transmitted_data.copy()
         transmitted_data.update(
@@ -124,12 +151,12 @@ class BaseStateHandler():
             }
         )
 
-        if inspect.iscoroutinefunction(func):
-            return await func(value, 
-                              transmitted_data=transmitted_data)
-        else:
-            return func(value, 
-                        transmitted_data=transmitted_data)
+        # Время включает следующий шаг конвейера, если function - next_step
+        with metrics.timer('css_callback_seconds', handler=self.indenf):
+            result = await call_callback(self.function, value,
+                                         transmitted_data=transmitted_data)
+        metrics.inc('css_callback_total', handler=self.indenf)
+        return result
 
     async def setup(self) -> tuple[bool, str]:
         """
@@ -149,9 +176,7 @@ class BaseStateHandler():
             image = self.message.image
 
             if image:
-                photo = await async_open(image, True)
-                res = await bot.send_photo(self.chatid, 
-                        photo, caption=text, 
+                res = await send_photo(self.chatid, image, caption=text, 
                         parse_mode=parse_mode, reply_markup=markup)
             else:
                 res = await bot.send_message(self.chatid, 
@@ -161,16 +186,23 @@ class BaseStateHandler():
 
         return
 
-    async def start(self) -> tuple[bool, str]:
+    async def start(self, clear: bool = True) -> tuple[bool, str]:
         """
         Запуск состояния. 
         Делаем стандартные действия и вызывает setup()
-        """
-        user_state = get_state(self.userid, self.chatid)
 
-        await user_state.clear()
-        res = await self.setup()
-        await self.message_sender()
+        clear=False - без очистки прежнего состояния (переход КСС): setup() записывает
+        состояние целиком, а автоматический ответ ведёт к следующему шагу или exit_chose
+        """
+        if clear:
+            await get_state(self.userid, self.chatid).clear()
+        with metrics.timer('css_handler_setup_seconds', handler=self.indenf):
+            res = await self.setup()
+        with metrics.timer('css_handler_send_seconds', handler=self.indenf):
+            await self.message_sender()
+
+        metrics.inc('css_handler_start_total', handler=self.indenf,
+                    outcome='wait' if res[0] else 'auto')
         return res
 
     async def set_data(self) -> None:
@@ -178,6 +210,7 @@ class BaseStateHandler():
 
         data = self.get_data()
         await state.set_data(data)
+        track_expiry(self.chatid, self.userid, data.get('expires_at'))
 
     def get_data(self) -> dict:
         data = self.__dict__.copy()
@@ -188,6 +221,19 @@ class BaseStateHandler():
         if 'time_start' not in data:
             data['time_start'] = int(time.time())
 
+        # Срок жизни: свой ttl, но не дольше срока конвейера
+        deadlines = []
+        ttl = default_ttl if self.ttl is None else self.ttl
+        if ttl:
+            deadlines.append(data['time_start'] + ttl)
+        if self.transmitted_data.get('expires_at'):
+            deadlines.append(self.transmitted_data['expires_at'])
+        if deadlines:
+            data['expires_at'] = min(deadlines)
+
+        if not data['on_expire']:
+            data['on_expire'] = self.transmitted_data.get('on_expire')
+
         return data
 
     async def set_state(self):
@@ -195,6 +241,13 @@ class BaseStateHandler():
         await user_state.set_state(self.state_type)
         return user_state
 
+    async def leave_state(self, state: FSMContext) -> None:
+        """ Очистка состояния после ответа, перед call_function.
+            Шаг КСС не очищается: следующий шаг перезапишет состояние, последний - exit_chose очистит
+        """
+        if self.function != NEXT_STEP:
+            await state.clear()
+
 class ChooseIntHandler(BaseStateHandler):
     state_name =  'ChooseInt'
     indenf = 'int'
@@ -218,7 +271,7 @@ class ChooseIntHandler(BaseStateHandler):
         """
 
         super().__init__(function, userid, chatid, lang, transmitted_data, 
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         self.min_int = min_int
         self.max_int = max_int
         self.autoanswer = autoanswer
@@ -254,7 +307,7 @@ class ChooseStringHandler(BaseStateHandler):
             Возвращает True если был создано состояние, не может завершится автоматически
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         self.min_len = min_len
         self.max_len = max_len
 
@@ -283,7 +336,7 @@ class ChooseTimeHandler(BaseStateHandler):
             Возвращает True если был создано состояние, не может завершится автоматически
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         self.min_int = min_int
         self.max_int = max_int
 
@@ -313,7 +366,7 @@ class ChooseConfirmHandler(BaseStateHandler):
             Возвращает True если был создано состояние, не может завершится автоматически
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         self.cancel = cancel
 
     async def setup(self):
@@ -331,6 +384,8 @@ class ChooseOptionHandler(BaseStateHandler):
                  transmitted_data:Optional[dict[str, BaseValueType]]=None,
                  message: Optional[StepMessage] = None,
                  messages_list: Optional[List[int]] = None,
+                 match_prefix: bool = False,
+                 options_id: Optional[str] = None,
                  **kwargs):
         """ Устанавливает состояние ожидания выбора опции
 
@@ -338,18 +393,24 @@ class ChooseOptionHandler(BaseStateHandler):
             >>> answer: ???, transmitted_data: dict
 
             options - {"кнопка": данные}
+            Ввод сравнивается с кнопками и без учёта регистра и лишних пробелов,
+            match_prefix - принимать начало текста, если так начинается только одна кнопка
+            options_id - id индекса вариантов (interface/option_index.py), для шагов плана - id шага
 
             Return:
             Возвращает True если был создано состояние, False если завершилось автоматически (1 вариант выбора)
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         if options is None: 
             self.options = {}
         else: self.options = options
+        self.match_prefix: bool = match_prefix
+        self.options_id: Optional[str] = options_id
 
     async def setup(self):
         if len(self.options) > 1:
+            self.options_id = store_index(self.options, self.options_id)
             await self.set_state()
             await self.set_data()
             return True, self.indenf
@@ -367,23 +428,38 @@ class ChooseInlineHandler(BaseStateHandler):
     deleted_keys = ['message']
 
     def __init__(self, function, userid, chatid, lang, 
-                 custom_code: str, 
+                 custom_code: str = '', 
                  transmitted_data: Optional[dict[str, BaseValueType]] = None,
                  one_element: bool = True,
                  message: Optional[StepMessage] = None,
                  messages_list: Optional[List[int]] = None,
+                 inline_options: Optional[dict] = None,
+                 callback_map: Optional[list] = None,
                  **kwargs):
         """ Устанавливает состояние ожидания нажатия кнопки
             Все ключи callback должны начинаться с 'chooseinline'
             custom_code - код сессии запроса кнопок (индекс 1)
 
+            inline_options - {"текст кнопки": данные}: кнопки собираются сами
+            (если у message нет клавиатуры), в callback_data - короткий id '#<номер>',
+            данные хранятся в состоянии (callback_map) - ограничение Telegram в 64 байта
+            на callback_data их не касается.
+
             В function передаёт 
             >>> answer: list, transmitted_data: dict
+                (для inline_options - данные нажатой кнопки)
         """
+        if inline_options:
+            custom_code = custom_code or DEFAULT_INLINE_CODE
+            callback_map = list(inline_options.values())
+            if message is not None and message.markup is None:
+                message = message.with_markup(inline_markup(custom_code, inline_options))
+
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         self.custom_code: str = custom_code
         self.one_element: bool = one_element
+        self.callback_map: Optional[list] = callback_map
 
     async def setup(self):
         await self.set_state()
@@ -415,7 +491,7 @@ class ChooseCustomHandler(BaseStateHandler):
                 result - второе возвращаемое из custom_handler
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
 
         if isinstance(custom_handler, str):
             self.custom_handler = custom_handler
@@ -423,8 +499,6 @@ class ChooseCustomHandler(BaseStateHandler):
             self.custom_handler = func_to_str(custom_handler)
 
     async def call_custom_handler(self, message: Message) -> tuple[bool, Any]:
-        func = str_to_func(self.custom_handler)
-
         transmitted_data = self.transmitted_data.copy()
         transmitted_data.update(
             {
@@ -434,10 +508,8 @@ class ChooseCustomHandler(BaseStateHandler):
             }
         )
 
-        if inspect.iscoroutinefunction(func):
-            return await func(message, transmitted_data=transmitted_data)
-        else:
-            return func(message, transmitted_data=transmitted_data)
+        return await call_callback(self.custom_handler, message,
+                                   transmitted_data=transmitted_data)
 
     async def setup(self):
         await self.set_state()
@@ -456,7 +528,7 @@ async def update_page(pages: list,
     """
 
     keyboard = list_to_keyboard(pages[page])
-    keyboard = down_menu(keyboard, len(pages) > 1, lang)
+    keyboard = down_menu(keyboard, len(pages) > 1)
 
     return await bot.send_message(chat_id, 
                                   upd_text, 
@@ -477,8 +549,13 @@ class ChoosePagesStateHandler(BaseStateHandler):
                  update_page_function: Optional[Callable]=None,
                  pages: Optional[list] = None,
                  page: int = 0,
+                 page_view: bool = False,
+                 options_provider: Optional[Callable] = None,
+                 pages_count: int = 1,
                  message: Optional[StepMessage] = None,
                  messages_list: Optional[List[int]] = None,
+                 match_prefix: bool = False,
+                 options_id: Optional[str] = None,
                  **kwargs):
         """ Устанавливает состояние ожидания выбора опции
     
@@ -486,9 +563,20 @@ class ChoosePagesStateHandler(BaseStateHandler):
                 'button_name': data
             }
 
+            Выбор сравнивается с кнопками и без учёта регистра и лишних пробелов,
+            match_prefix - принимать начало текста, если так начинается только одна кнопка
+            options_id - id индекса вариантов (interface/option_index.py), для шагов плана - id шага
+
             autoanswer - надо ли делать авто ответ, при 1-ом варианте
             horizontal, vertical - размер страницы
             one_element - будет ли завершаться работа после выбора одного элемента
+            page_view - не хранить страницы в состоянии, а собирать нужную страницу из options
+                (в update_page_function вместо списка страниц передаётся PagesView)
+
+            options_provider - функция, отдающая options постранично вместо полного options
+            >>> page: int, page_size: int, transmitted_data: dict
+                return options: dict, total: int | has_more: bool
+                В состоянии хранится только текущая страница, выбор ищется в ней.
 
             В function передаёт 
             >>> answer: ???, transmitted_data: dict
@@ -508,7 +596,7 @@ class ChoosePagesStateHandler(BaseStateHandler):
             Возвращает True если был создано состояние, False если завершилось автоматически (1 вариант выбора)
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
 
         self.options: dict = options or {}
         self.autoanswer: bool = autoanswer
@@ -523,42 +611,100 @@ class ChoosePagesStateHandler(BaseStateHandler):
 
         self.pages: list = pages or []
         self.page: int = page
+
+        if isinstance(options_provider, str) or options_provider is None:
+            self.options_provider: Optional[str] = options_provider
+        elif callable(options_provider):
+            self.options_provider = func_to_str(options_provider)
+        self.pages_count: int = pages_count
+        self.match_prefix: bool = match_prefix
+        self.options_id: Optional[str] = options_id
         self.settings: dict = {
             'horizontal': horizontal,
-            'vertical': vertical
+            'vertical': vertical,
+            'page_view': page_view
         }
 
         if settings:
             self.settings.update(settings)
 
-    async def call_update_page_function(self, pages: 
-        list, page: int, chatid: int, lang: str):
-        func = str_to_func(self.update_page_function)
+    @property
+    def page_view(self) -> bool:
+        return self.settings.get('page_view', False)
+
+    def set_options(self, options: dict) -> None:
+        """ Новые options (ответ function) и индекс для них
+        """
+        self.options = options
+        self.options_id = store_index(options)
+
+    def make_pages(self, options: dict) -> Union[list, PagesView]:
+        """ Страницы для options: PagesView в режиме page_view, иначе список из chunk_pages
+        """
+        if self.page_view:
+            return PagesView(options, self.settings['horizontal'], self.settings['vertical'])
+        return chunk_pages(options, self.settings['horizontal'], self.settings['vertical'])
 
-        if inspect.iscoroutinefunction(func):
-            return await func(pages, page, chatid, lang)
+    async def load_page(self, page: int) -> None:
+        """ Загружает страницу page из options_provider
+        """
+        size = self.settings['horizontal'] * self.settings['vertical']
+        options, total = await call_callback(self.options_provider,
+                                             page, size, self.transmitted_data)
+
+        if isinstance(total, bool):
+            self.pages_count = page + 2 if total else page + 1
         else:
-            return func(pages, page, chatid, lang)
+            self.pages_count = max(1, -(-total // size))
+
+        # Страница небольшая - индекс для неё не хранится
+        self.options = options or {}
+        self.options_id = None
+        self.page = page
+
+    def current_pages(self) -> Union[list, PagesView]:
+        """ Страницы текущего состояния
+        """
+        if self.options_provider:
+            return PagesView(self.options, self.settings['horizontal'], self.settings['vertical'],
+                             page=self.page, pages_count=self.pages_count)
+        if self.page_view:
+            return self.make_pages(self.options)
+        return self.pages
+
+    async def call_update_page_function(self, pages: 
+        list, page: int, chatid: int, lang: str):
+        return await call_callback(self.update_page_function,
+                                   pages, page, chatid, lang)
 
     async def setup(self):
         # Чанкует страницы и добавляем пустые элементы для сохранения структуры
-        self.pages = chunk_pages(self.options, 
-                                 self.settings['horizontal'], self.settings['vertical'])
+        # (в режиме page_view в состоянии остаются только options и размеры страницы)
+        if self.options_provider:
+            await self.load_page(self.page)
+            pages = self.current_pages()
+        elif self.page_view:
+            pages = self.make_pages(self.options)
+        else:
+            # Страницы уже могут быть посчитаны (шаг плана КСС)
+            pages = self.pages = self.pages or self.make_pages(self.options)
 
         if len(self.options) > 1 or not self.autoanswer:
+            if not self.options_provider:
+                self.options_id = store_index(self.options, self.options_id)
             await self.set_state()
             await self.set_data()
 
-            await self.call_update_page_function(self.pages, 
+            await self.call_update_page_function(pages, 
                                 self.page, self.chatid, self.lang)
-            return True, self.pages
+            return True, pages
         else:
             if len(self.options) == 0:
                 element = None
             else:
                 element = self.options[list(self.options.keys())[0]]
             await self.call_function(element)
-            return False, self.pages
+            return False, pages
 
 class ChooseImageHandler(BaseStateHandler):
     state_name = 'ChooseImage'
@@ -583,7 +729,7 @@ class ChooseImageHandler(BaseStateHandler):
                 True, 'image'
         """
         super().__init__(function, userid, chatid, lang, transmitted_data,
-                         message=message, messages_list=messages_list)
+                         message=message, messages_list=messages_list, **kwargs)
         self.need_image = need_image
 
     async def setup(self):
@@ -605,12 +751,7 @@ class BaseUpdateHandler():
         self.transmitted_data: dict = transmitted_data or {}
 
     async def start(self) -> tuple[dict[str, Any], bool]:
-        func = str_to_func(self.function)
-
-        if inspect.iscoroutinefunction(func):
-            return await func(self.transmitted_data)
-        else:
-            return func(self.transmitted_data)
+        return await call_callback(self.function, self.transmitted_data)
 
     async def get_data(self) -> dict[str, Any]:
         return self.__dict__
@@ -642,7 +783,9 @@ class ChooseStepHandler():
                  userid: int, chatid: int, 
                  lang: str, 
                  steps: list[DataType],
-                 transmitted_data:Optional[dict[str, BaseValueType]] = None):
+                 transmitted_data:Optional[dict[str, BaseValueType]] = None,
+                 ttl: Optional[int] = None,
+                 on_expire: Optional[Callable | str] = None):
         """ Конвейерная Система Состояний (КСС)
             Устанавливает ожидание нескольких ответов, запуская состояния по очереди.
 
@@ -685,6 +828,10 @@ class ChooseStepHandler():
             edit_message (bool, optional) - если нужно не отсылать сообщения, а обновлять, то можно добавить этот ключ.
             delete_steps (bool, optional) - можно добавить для удаления данных отработанных шагов
 
+            ttl (int, optional) - время жизни всего конвейера в секундах
+            on_expire (optional) - функция, вызываемая если конвейер не завершён за ttl
+            >>> transmitted_data: dict
+
             В function передаёт 
             >>> answer: dict, transmitted_data: dict
         """
@@ -710,12 +857,19 @@ class ChooseStepHandler():
         self.chatid: int = chatid
         self.lang: str = lang
 
+        self.ttl: Optional[int] = ttl
+        self.on_expire: Optional[str] = func_to_str(on_expire) if callable(on_expire) else on_expire
+
     async def start(self) -> None:
-        steps_data = []
-        for step in self.steps:
-            steps_data.append(
-                step.to_dict()
-            )
+        plan = compile_plan(self.steps)
+        await store_plan(plan)
+        acquire_plan(plan.plan_id)
+
+        if self.ttl:
+            self.transmitted_data['expires_at'] = int(time.time()) + self.ttl
+        if self.on_expire:
+            self.transmitted_data['on_expire'] = self.on_expire
+        start_trace(self.transmitted_data)
 
         self.transmitted_data.update(
             {
@@ -723,9 +877,10 @@ class ChooseStepHandler():
                 'chatid': self.chatid,
                 'lang': self.lang,
                 'return_function': self.function,
-                'steps': steps_data,
+                'plan': plan.plan_id,
                 'process': 0,
-                'return_data': {}
+                'return_data': {},
+                'step_state': {}
             }
         )
 
@@ -737,14 +892,15 @@ async def exit_chose(state, transmitted_data: dict):
 
     return_function: str = transmitted_data['return_function']
     return_data = transmitted_data['return_data']
+    close_conveyor(transmitted_data, transmitted_data.get('userid'), 'finished')
+
     for i in ['return_function', 'return_data', 'process']:
         del transmitted_data[i]
+    for i in ['plan', 'step_state', 'expires_at', 'on_expire', 'trace']:
+        transmitted_data.pop(i, None)
 
-    call_func = str_to_func(return_function)
-    if inspect.iscoroutinefunction(call_func):
-        await call_func(return_data, transmitted_data)
-    else:
-        call_func(return_data, transmitted_data)
+    metrics.inc('css_conveyor_finished_total')
+    await call_callback(return_function, return_data, transmitted_data)
 
 async def next_step(answer: Any, 
                     transmitted_data: dict, 
@@ -762,197 +918,230 @@ async def next_step(answer: Any,
         (Использовать только для inline состояний, не подойдёт для MessageSteps)
     """
 
+    # Отслеживаем изменения, чтобы записывать в хранилище только их
+    if not isinstance(transmitted_data, TrackedDict):
+        transmitted_data = TrackedDict(transmitted_data)
+
     userid = transmitted_data['userid']
     chatid = transmitted_data['chatid']
     lang = transmitted_data['lang']
-    steps_raw = transmitted_data['steps']
-    process = transmitted_data['process']
-    return_data = transmitted_data['return_data']
-
+    plan = await load_plan(transmitted_data['plan'])
     user_state = get_state(userid, chatid)
-    temp = {}
 
-    # Преобразование в дата классы для удобной работы
-    steps: list[Union[Type[BaseDataType], BaseUpdateType]] = []
-    for raw_step in steps_raw.copy():
-        if raw_step['type'] in state_handler_registry.keys():
-            step = get_step_data(**raw_step)
-        else:
-            new_step: dict = raw_step.copy()
-            new_step.pop('type', None)
-            step = BaseUpdateType(**new_step)
-
-        steps.append(step)
-
-    current_step: Union[Type[BaseDataType], BaseUpdateType] = steps[process]
-
-    # Обновление внутренних данных
-    if not start:
-
-        # Обновляем данные в return_data если есть имя
-        if isinstance(current_step, (BaseDataType)):
-            name = current_step.name
-            if name:
-                # Добавление данных в return_data
-                if name in return_data:
-                    if isinstance(return_data[name], list):
-                        return_data[name].append(answer)
-                    else:
-                        return_data[name] = [
-                            return_data[name], answer
-                            ]
-                else: 
-                    return_data[name] = answer
-        process += 1
-
-    # Выполнение работы для последнего выполненного шага
-    if process - 1 >= 0:
-        last_step: Union[Type[BaseDataType], BaseUpdateType] = steps[process - 1]
-        raw_dat = steps_raw[process - 1]
-
-        if isinstance(last_step, InlineStepData):
-            if last_step.delete_markup:
-                messageid = raw_dat.get('messageid', None)
-                if messageid:
-                    await bot.edit_message_reply_markup(None, chatid, 
-                            messageid, 
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[]))
-
-            if last_step.delete_message:
-                messageid = raw_dat.get('bmessageid', None)
-                if messageid:
-                    await bot.delete_message(chatid, messageid)
-
-            if last_step.delete_user_message:
-                messageid = raw_dat.get('umessageid', None)
-                if messageid:
-                    await bot.delete_message(chatid, messageid)
-
-    # Работа с новым шагом
-    if process < len(steps):
-        next_step_obj: DataType = steps[process]
-        step_data = next_step_obj.to_handler_data()
-
-        if isinstance(next_step_obj, BaseUpdateType):
-            # Обновление данных между запросами
-            transmitted_data['process'] = process
-            transmitted_data['return_data'] = return_data
-            handler = BaseUpdateHandler
-
-            self_handler = handler(**step_data, transmitted_data=transmitted_data)
-            transmitted_data, answer = await self_handler.start() # Передаём transmitted_data,
-            # Получаем transmitted_data и ответ для сохранения
-
-            process = transmitted_data['process']
-
-            new_steps: list[dict] = []
-            for raw_step in transmitted_data['steps'].copy():
-                if not isinstance(raw_step, dict):
-                    new_steps.append(raw_step.to_dict())
-                else:
-                    new_steps.append(raw_step)
-
-            transmitted_data['steps'] = new_steps
-
-            if process >= len(steps):
-                # Если это последний шаг, то удаляем состояние и завершаем работу
-                await exit_chose(user_state, transmitted_data)
-                return
-
-            await user_state.update_data(transmitted_data=transmitted_data)
-            await next_step(answer, transmitted_data)
-            return
-
-        if transmitted_data.get('temp', False):
-            # Если это inline состояние, то обновляем сообщение
-            temp = transmitted_data['temp'].copy()
-            del transmitted_data['temp']
-
-        if isinstance(next_step_obj, (BaseDataType)):
-            # Запуск следующего состояния
-            type_handler = next_step_obj.type
-            handler = state_handler_registry[type_handler]
-
-            transmitted_data['process'] = process
-            transmitted_data['return_data'] = return_data
-
-            self_handler = handler(**step_data, userid=userid, chatid=chatid, 
-                                   lang=lang, function=next_step, transmitted_data=transmitted_data)
-
-            func_answer, func_type = await self_handler.start()
-
-            # Если состояние завершилось автоматически, то удаляем состояние
-            if func_type == 'cancel': await user_state.clear()
-
-            if func_answer:
-                # Отправка сообщения / фото из image, если None - ничего
-                edit_message, last_message = False, None
-                bmessage = None
-                message_data = next_step_obj.message
-
-                if 'edit_message' in transmitted_data:
-                    edit_message = transmitted_data['edit_message']
-
-                if 'message_data' in temp:
-                    last_message = temp['message_data']
-
-                if message_data:
-                    step_0: (BaseDataType) = steps[0] # type: ignore
-                    if edit_message and last_message:
-                        if step_0.message and step_0.message.image:
-                            markup = None
-
-                            if isinstance(message_data.markup, InlineKeyboardMarkup):
-                                markup = message_data.markup
-
-                            await bot.edit_message_caption(
-                                chat_id=chatid, message_id=last_message.message_id,
-                                parse_mode='Markdown', 
-                                caption=message_data.get_text(lang),
-                                reply_markup=markup,
-                                )
+    # Подряд идущие шаги обновления выполняются в цикле, а не рекурсией
+    hops = 0
+    while True:
+        process = transmitted_data['process']
+        return_data = transmitted_data['return_data']
+        step_state = transmitted_data.get('step_state', {})
+        temp = {}
+
+        # Шаги уже разобраны в плане
+        steps: list[Union[BaseDataType, BaseUpdateType]] = plan.steps
+
+        current_step: Union[BaseDataType, BaseUpdateType] = steps[process]
+
+        # Обновление внутренних данных
+        if not start:
+
+            # Обновляем данные в return_data если есть имя
+            if isinstance(current_step, (BaseDataType)):
+                step_answered(transmitted_data, current_step, process, step_state)
+                name = current_step.name
+                if name:
+                    # Добавление данных в return_data
+                    if name in return_data:
+                        if isinstance(return_data[name], list):
+                            return_data[name].append(answer)
+                        else:
+                            return_data[name] = [
+                                return_data[name], answer
+                                ]
+                    else: 
+                        return_data[name] = answer
+            process += 1
+
+        # Выполнение работы для последнего выполненного шага
+        if process - 1 >= 0:
+            last_step: Union[BaseDataType, BaseUpdateType] = steps[process - 1]
+            raw_dat = step_state
+
+            if isinstance(last_step, InlineStepData):
+                # Кнопки убираем до следующего шага, удаления уходят в фон
+                effects = SideEffects()
+
+                if last_step.delete_markup:
+                    messageid = raw_dat.get('messageid', None)
+                    if messageid:
+                        effects.add(bot.edit_message_reply_markup(None, chatid, 
+                                messageid, 
+                                reply_markup=InlineKeyboardMarkup(inline_keyboard=[])),
+                                critical=True)
+
+                if last_step.delete_message:
+                    messageid = raw_dat.get('bmessageid', None)
+                    if messageid:
+                        effects.add(bot.delete_message(chatid, messageid))
+
+                if last_step.delete_user_message:
+                    messageid = raw_dat.get('umessageid', None)
+                    if messageid:
+                        effects.add(bot.delete_message(chatid, messageid))
+
+                await effects.run()
+
+        # Работа с новым шагом
+        if process < len(steps):
+            next_step_obj: DataType = steps[process]
+            step_data = plan.get_handler_data(process)
+            metrics.inc('css_steps_total', step_type=next_step_obj.type)
+
+            if isinstance(next_step_obj, BaseUpdateType):
+                # Обновление данных между запросами
+                transmitted_data['process'] = process
+                transmitted_data['return_data'] = return_data
+                handler = BaseUpdateHandler
+
+                hops += 1
+                if hops > MAX_UPDATE_HOPS:
+                    raise RuntimeError(f"Более {MAX_UPDATE_HOPS} шагов обновления подряд "
+                                       f"(план {transmitted_data['plan']}, шаг {process})")
+
+                # Функции обновления видят шаги плана в transmitted_data['steps'] (копии словарей шагов).
+                # Ключ временный: в состояние не пишется (мимо отслеживания изменений TrackedDict)
+                dict.__setitem__(transmitted_data, 'steps', plan.steps_view())
+
+                self_handler = handler(**step_data, transmitted_data=transmitted_data)
+                update_start = time.perf_counter()
+                transmitted_data, answer = await self_handler.start() # Передаём transmitted_data,
+                # Получаем transmitted_data и ответ для сохранения
+                update_step_done(transmitted_data, next_step_obj, process,
+                                 time.perf_counter() - update_start)
+
+                process = transmitted_data['process']
+
+                # Функция обновления может изменить или заменить шаги в steps - план пересобирается
+                new_steps = dict.pop(transmitted_data, 'steps', None)
+                if new_steps is not None and new_steps != plan.raw_steps:
+                    plan = compile_plan(new_steps)
+                    await store_plan(plan)
+                    if plan.plan_id != transmitted_data['plan']:
+                        acquire_plan(plan.plan_id)
+                        release_plan(transmitted_data['plan'])
+                    transmitted_data['plan'] = plan.plan_id
+
+                if process >= len(plan):
+                    # Если это последний шаг, то удаляем состояние и завершаем работу
+                    await exit_chose(user_state, transmitted_data)
+                    return
+
+                # Следующий шаг - на следующей итерации цикла, без записи состояния:
+                # его запишет обработчик шага (или exit_chose очистит)
+                if not isinstance(transmitted_data, TrackedDict):
+                    transmitted_data = TrackedDict(transmitted_data)
+                start = False
+                continue
+
+            if transmitted_data.get('temp', False):
+                # Если это inline состояние, то обновляем сообщение
+                temp = transmitted_data['temp'].copy()
+                del transmitted_data['temp']
+
+            if isinstance(next_step_obj, (BaseDataType)):
+                # Запуск следующего состояния
+                type_handler = next_step_obj.type
+                handler = state_handler_registry[type_handler]
+
+                transmitted_data['process'] = process
+                transmitted_data['return_data'] = return_data
+                transmitted_data['step_state'] = step_state = {}
+
+                self_handler = handler(**step_data, userid=userid, chatid=chatid, 
+                                       lang=lang, function=next_step, transmitted_data=transmitted_data)
+
+                func_answer, func_type = await self_handler.start(clear=False)
+                # Обработчик уже записал transmitted_data целиком
+                transmitted_data.reset()
+
+                # Если состояние завершилось автоматически, то удаляем состояние
+                if func_type == 'cancel': await user_state.clear()
+
+                if func_answer:
+                    # Отправка сообщения / фото из image, если None - ничего
+                    edit_message, last_message = False, None
+                    bmessage = None
+                    message_data = next_step_obj.message
+
+                    if 'edit_message' in transmitted_data:
+                        edit_message = transmitted_data['edit_message']
+
+                    if 'message_data' in temp:
+                        last_message = temp['message_data']
+
+                    if message_data:
+                        step_0: (BaseDataType) = steps[0] # type: ignore
+                        if edit_message and last_message:
+                            if step_0.message and step_0.message.image:
+                                markup = None
+
+                                if isinstance(message_data.markup, InlineKeyboardMarkup):
+                                    markup = message_data.markup
+
+                                await bot.edit_message_caption(
+                                    chat_id=chatid, message_id=last_message.message_id,
+                                    parse_mode='Markdown', 
+                                    caption=message_data.get_text(lang),
+                                    reply_markup=markup,
+                                    )
  
-                        if step_0.message and not step_0.message.image:
+                            if step_0.message and not step_0.message.image:
 
-                            markup = None
-                            if isinstance(message_data.markup, InlineKeyboardMarkup):
-                                markup = message_data.markup
+                                markup = None
+                                if isinstance(message_data.markup, InlineKeyboardMarkup):
+                                    markup = message_data.markup
 
-                            await bot.edit_message_text(text=message_data.get_text(lang), 
-                                chat_id=chatid, message_id=last_message.message_id,
-                                parse_mode='Markdown', 
-                                reply_markup=markup,
-                                )
+                                await bot.edit_message_text(text=message_data.get_text(lang), 
+                                    chat_id=chatid, message_id=last_message.message_id,
+                                    parse_mode='Markdown', 
+                                    reply_markup=markup,
+                                    )
 
-                        bmessage = last_message
+                            bmessage = last_message
 
-                    else:
-                        if message_data.image:
-                            photo = await async_open(message_data.image, True)
-                            bmessage = await bot.send_photo(chatid, 
-                                photo=photo, parse_mode='Markdown', 
-                                caption=message_data.get_text(lang),
-                                reply_markup=message_data.markup,
-                            )
                         else:
-                            try:
-                                bmessage = await bot.send_message(chatid, 
-                                        parse_mode='Markdown', text=message_data.get_text(lang), reply_markup=message_data.markup)
-                            except:
-                                bmessage = await bot.send_message(chatid,          
-                                        text=message_data.get_text(lang), reply_markup=message_data.markup)
-
-                if bmessage:
-                    steps_raw[process]['bmessageid'] = bmessage.message_id
+                            if message_data.image:
+                                bmessage = await send_photo(chatid, message_data.image,
+                                    parse_mode='Markdown', 
+                                    caption=message_data.get_text(lang),
+                                    reply_markup=message_data.markup,
+                                )
+                            else:
+                                try:
+                                    bmessage = await bot.send_message(chatid, 
+                                            parse_mode='Markdown', text=message_data.get_text(lang), reply_markup=message_data.markup)
+                                except:
+                                    metrics.inc('css_errors_total', where='markdown_fallback')
+                                    bmessage = await bot.send_message(chatid,          
+                                            text=message_data.get_text(lang), reply_markup=message_data.markup)
+
+                    if bmessage:
+                        step_state['bmessageid'] = bmessage.message_id
+                        transmitted_data.mark('step_state')
+
+                # Обновление данных состояния (только изменённые ключи)
+                if func_answer:
+                    if 'trace' in transmitted_data:
+                        step_shown(transmitted_data, step_state)
+                        transmitted_data.mark('step_state')
+                    await save_changes(user_state, transmitted_data)
 
-            # Обновление данных состояния
-            if not start and func_answer:
-                transmitted_data['steps'] = steps_raw
-                await user_state.update_data(transmitted_data=transmitted_data)
+        else:
+            await exit_chose(user_state, transmitted_data)
+        return
 
-    else:
-        await exit_chose(user_state, transmitted_data)
 
+# Путь next_step: function обработчиков шагов КСС
+NEXT_STEP: str = func_to_str(next_step)
 
 # Словарь хранения состояний
 states_to_str: dict[str, State] = get_state_names()
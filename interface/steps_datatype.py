@@ -1,13 +1,15 @@
-from typing import Optional, Type, Union, Callable
+from typing import Any, Optional, Type, Union, Callable
 from aiogram.types import ReplyKeyboardMarkup, InlineKeyboardMarkup
 
-from interface.utils import func_to_str
+from interface.option_index import DEFAULT_INLINE_CODE, inline_markup
+from interface.utils import chunk_pages, func_to_str
 from typing import Union
 
 class BaseUpdateType():
 
     type: str = 'update'
     data_keys: list[str] = []
+    __slots__ = ('function', 'data')
 
     def __init__(self, 
                  function: Optional[Callable] = None,
@@ -25,26 +27,26 @@ class BaseUpdateType():
                 setattr(self, key, self.data[key])
 
     def to_dict(self):
-        ret_data = self.__dict__.copy()
-
+        # Своя копия: data передал вызывающий код
+        data = dict(self.data)
         for i in self.data_keys:
-            ret_data['data'][i] = getattr(self, i)
-            del ret_data[i]
+            data[i] = getattr(self, i)
 
-        ret_data['type'] = self.type
-        return ret_data
+        return {'function': self.function, 'data': data, 'type': self.type}
 
     def to_handler_data(self):
-        ret_data = self.__dict__.copy()
+        ret_data = {'function': self.function}
 
-        for i in self.data.keys():
-            ret_data[i] = getattr(self, i)
-
-        del ret_data['data']
+        for i in self.data_keys:
+            if i in self.data:
+                ret_data[i] = getattr(self, i)
         return ret_data
 
 class StepMessage():
 
+    __slots__ = ('translate_message', 'text', 'text_data', 'image', 'parse_mode',
+                 'markup', '_markup_dumps')
+
     def __init__(self, text: str,
                  markup: Union[ReplyKeyboardMarkup, dict, InlineKeyboardMarkup, None] = None,
                  translate_message: bool = False, 
@@ -66,15 +68,37 @@ class StepMessage():
         else:
             self.markup = markup
 
-    def to_dict(self): 
-        data = self.__dict__.copy()
+        # exclude_none -> (клавиатура, её model_dump)
+        self._markup_dumps: dict[bool, tuple[Any, dict]] = {}
+
+    def markup_dump(self, exclude_none: bool = False) -> Any:
+        """ model_dump клавиатуры, считается один раз на объект клавиатуры.
+            Результат общий - не изменять.
+        """
+        if not isinstance(self.markup, (ReplyKeyboardMarkup, InlineKeyboardMarkup)):
+            return self.markup
 
-        if isinstance(self.markup, ReplyKeyboardMarkup):
-            data['markup'] = self.markup.model_dump()
-        elif isinstance(self.markup, InlineKeyboardMarkup):
-            data['markup'] = self.markup.model_dump()
+        cached = self._markup_dumps.get(exclude_none)
+        if cached is None or cached[0] is not self.markup:
+            cached = (self.markup, self.markup.model_dump(exclude_none=exclude_none))
+            self._markup_dumps[exclude_none] = cached
+        return cached[1]
 
-        return data
+    def with_markup(self, markup: Union[ReplyKeyboardMarkup, InlineKeyboardMarkup, None]) -> 'StepMessage':
+        """ Копия сообщения с другой клавиатурой
+        """
+        return StepMessage(self.text, markup, self.translate_message, self.text_data,
+                           self.image, self.parse_mode)
+
+    def to_dict(self): 
+        return {
+            'translate_message': self.translate_message,
+            'text': self.text,
+            'text_data': self.text_data,
+            'image': self.image,
+            'parse_mode': self.parse_mode,
+            'markup': self.markup_dump(),
+        }
 
     def get_text(self, lang: str):
 
@@ -88,6 +112,27 @@ class BaseDataType():
 
     type: str = 'base'
     data_keys: list[str] = []
+    # Поля экземпляра: data_keys и остальные параметры конструктора (они же __slots__).
+    # data_keys, не перечисленные в fields, добавляются в fields сами (шаги, объявившие только data_keys).
+    # Ключи data вне fields атрибутами не становятся и остаются только в data
+    fields: tuple[str, ...] = ()
+    __slots__ = ('name', 'data', 'message')
+
+    # Считаются один раз на класс
+    _field_set: frozenset[str] = frozenset()
+    _top_fields: tuple[str, ...] = ()
+    _has_dict: bool = False
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        missing = tuple(i for i in cls.data_keys if i not in cls.fields)
+        if missing:
+            cls.fields = tuple(cls.fields) + missing
+        cls._field_set = frozenset(cls.fields)
+        # Поля вне data_keys to_dict кладёт рядом с data, а не в неё
+        cls._top_fields = tuple(i for i in cls.fields if i not in cls.data_keys)
+        # Класс без своих __slots__: атрибуты вне fields лежат в __dict__ и тоже сохраняются
+        cls._has_dict = any('__dict__' in vars(i) for i in cls.__mro__)
 
     def __init__(self, name: Optional[str], 
                  message: Union[StepMessage, dict, None], 
@@ -104,15 +149,23 @@ class BaseDataType():
             self.message: Optional[StepMessage] = message
 
         # Приоритет значениям из data
-        for key in self.data.keys():
-            setattr(self, key, self.data[key])
+        for key, value in self.data.items():
+            if key in self._field_set:
+                setattr(self, key, value)
 
     def to_dict(self):
-        ret_data = self.__dict__.copy()
-
+        # Своя копия: data передал вызывающий код
+        data = dict(self.data)
         for i in self.data_keys:
-            ret_data['data'][i] = getattr(self, i)
-            del ret_data[i]
+            data[i] = getattr(self, i)
+
+        ret_data = {i: getattr(self, i) for i in self._top_fields}
+        if self._has_dict:
+            for key, value in self.__dict__.items():
+                if key not in self.data_keys:
+                    ret_data.setdefault(key, value)
+        ret_data['name'] = self.name
+        ret_data['data'] = data
 
         if isinstance(self.message, StepMessage):
             ret_data['message'] = self.message.to_dict()
@@ -123,20 +176,18 @@ class BaseDataType():
         return ret_data
     
     def to_handler_data(self):
-        ret_data = self.__dict__.copy()
-
-        for i in self.data.keys():
-            ret_data[i] = self.data[i]
-
-        del ret_data['data']
-        del ret_data['message']
-        del ret_data['name']
+        ret_data = {i: getattr(self, i) for i in self.fields}
+        if self._has_dict:
+            ret_data.update(self.__dict__)
+        ret_data.update(self.data)
         return ret_data
 
 class IntStepData(BaseDataType):
 
     type: str = 'int'
     data_keys: list[str] = ['max_int', 'min_int']
+    fields: tuple[str, ...] = ('max_int', 'min_int', 'autoanswer')
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
@@ -153,6 +204,8 @@ class IntStepData(BaseDataType):
 class StringStepData(BaseDataType):
     type: str = 'str'
     data_keys: list[str] = ['min_len', 'max_len']
+    fields: tuple[str, ...] = ('min_len', 'max_len')
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
@@ -167,6 +220,8 @@ class StringStepData(BaseDataType):
 class TimeStepData(BaseDataType):
     type: str = 'time'
     data_keys: list[str] = ['min_int', 'max_int']
+    fields: tuple[str, ...] = ('min_int', 'max_int')
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
@@ -181,6 +236,8 @@ class TimeStepData(BaseDataType):
 class ConfirmStepData(BaseDataType):
     type: str = 'bool'
     data_keys: list[str] = ['cancel']
+    fields: tuple[str, ...] = ('cancel',)
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
@@ -193,6 +250,8 @@ class ConfirmStepData(BaseDataType):
 class OptionStepData(BaseDataType):
     type: str = 'option'
     data_keys: list[str] = ['options']
+    fields: tuple[str, ...] = ('options',)
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
@@ -204,6 +263,9 @@ class OptionStepData(BaseDataType):
 class InlineStepData(BaseDataType):
     type: str = 'inline'
     data_keys: list[str] = ['custom_code', 'delete_markup', 'delete_user_message', 'delete_message', 'one_element']
+    fields: tuple[str, ...] = ('custom_code', 'delete_markup', 'delete_user_message',
+                                 'delete_message', 'one_element')
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage,  
@@ -221,14 +283,24 @@ class InlineStepData(BaseDataType):
         self.one_element: bool = one_element
         super().__init__(name, message, data)
 
+        # inline_options в data: кнопки с короткими id собираются один раз на шаг
+        inline_options = self.data.get('inline_options')
+        if inline_options:
+            self.custom_code = self.custom_code or DEFAULT_INLINE_CODE
+            if self.message is not None and self.message.markup is None:
+                self.message = self.message.with_markup(inline_markup(self.custom_code, inline_options))
+
 class CustomStepData(BaseDataType):
     type: str = 'custom'
     data_keys: list[str] = ['custom_handler']
+    fields: tuple[str, ...] = ('custom_handler',)
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
                  data: Optional[dict] = None, 
                  custom_handler: Optional[Callable] = None):
+        self.custom_handler: Optional[str] = None
         if isinstance(custom_handler, str):
             self.custom_handler = custom_handler
         elif callable(custom_handler):
@@ -238,7 +310,10 @@ class CustomStepData(BaseDataType):
 
 class PagesStepData(BaseDataType):
     type: str = 'pages'
-    data_keys: list[str] = ['options', 'horizontal', 'vertical', 'autoanswer', 'one_element', 'settings', 'update_page_function']
+    data_keys: list[str] = ['options', 'horizontal', 'vertical', 'autoanswer', 'one_element', 'settings', 'update_page_function', 'options_provider']
+    fields: tuple[str, ...] = ('options', 'horizontal', 'vertical', 'autoanswer', 'one_element',
+                                 'settings', 'update_page_function', 'options_provider')
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
@@ -249,6 +324,7 @@ class PagesStepData(BaseDataType):
                  one_element: bool = True,
                  settings: Optional[dict] = None,
                  update_page_function: Optional[Callable] = None,
+                 options_provider: Optional[Callable] = None,
                 ):
         self.options: dict = options or {}
         self.horizontal: int = horizontal
@@ -262,12 +338,30 @@ class PagesStepData(BaseDataType):
             self.update_page_function = func_to_str(update_page_function)
         if update_page_function is None:
             self.update_page_function = None
+        if isinstance(options_provider, str) or options_provider is None:
+            self.options_provider = options_provider
+        elif callable(options_provider):
+            self.options_provider = func_to_str(options_provider)
 
         super().__init__(name, message, data)
 
+    def to_handler_data(self):
+        ret_data = super().to_handler_data()
+
+        # Страницы считаются один раз на план, а не для каждого пользователя
+        settings = {'horizontal': ret_data['horizontal'], 'vertical': ret_data['vertical'],
+                    'page_view': ret_data.get('page_view', False)}
+        settings.update(ret_data['settings'])
+        if not settings['page_view'] and not ret_data['options_provider']:
+            ret_data['pages'] = chunk_pages(ret_data['options'],
+                                            settings['horizontal'], settings['vertical'])
+        return ret_data
+
 class ImageStepData(BaseDataType):
     type: str = 'image'
     data_keys: list[str] = ['need_image']
+    fields: tuple[str, ...] = ('need_image',)
+    __slots__ = fields
 
     def __init__(self, name: Optional[str], 
                  message: StepMessage | None,  
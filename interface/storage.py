@@ -0,0 +1,393 @@
+import asyncio
+import json
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Optional, Type, Union
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+def key_to_str(key: StorageKey) -> str:
+    """ Преобразует ключ хранилища в строку для базы данных
+    """
+    return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:"
+            f"{key.business_connection_id}:{key.destiny}")
+
+def json_default(obj: Any) -> Any:
+    """ Сериализация значений, которые json не умеет сохранять (объекты aiogram, bson)
+    """
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump(mode='json')
+    return str(obj)
+
+
+_CREATE_TABLES = (
+    "CREATE TABLE IF NOT EXISTS fsm_state (key TEXT PRIMARY KEY, state TEXT)",
+    "CREATE TABLE IF NOT EXISTS fsm_fields (key TEXT, field TEXT, value TEXT, PRIMARY KEY (key, field))",
+    "CREATE TABLE IF NOT EXISTS css_plans (plan_id TEXT PRIMARY KEY, steps TEXT)",
+)
+# Запросы неизменны, поэтому sqlite3 держит их подготовленными в кэше соединения
+_SELECT_STATE = "SELECT state FROM fsm_state WHERE key = ?"
+_SELECT_FIELDS = "SELECT field, value FROM fsm_fields WHERE key = ? ORDER BY field"
+_UPSERT_STATE = ("INSERT INTO fsm_state (key, state) VALUES (?, ?) "
+                 "ON CONFLICT(key) DO UPDATE SET state = excluded.state")
+_UPSERT_FIELD = ("INSERT INTO fsm_fields (key, field, value) VALUES (?, ?, ?) "
+                 "ON CONFLICT(key, field) DO UPDATE SET value = excluded.value")
+_DELETE_STATE = "DELETE FROM fsm_state WHERE key = ?"
+_DELETE_KEY_FIELDS = "DELETE FROM fsm_fields WHERE key = ?"
+# Удаляет поле вместе с его вложенными строками (field\x1fsub)
+_DELETE_FIELD = "DELETE FROM fsm_fields WHERE key = ? AND (field = ? OR (field > ? AND field < ?))"
+_DELETE_SUBFIELD = "DELETE FROM fsm_fields WHERE key = ? AND field = ?"
+_SELECT_PLAN = "SELECT steps FROM css_plans WHERE plan_id = ?"
+_INSERT_PLAN = "INSERT OR IGNORE INTO css_plans (plan_id, steps) VALUES (?, ?)"
+
+_MISSING = object()
+_SEP = '\x1f'
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM хранилище в локальной базе SQLite (режим WAL).
+
+    Записи складываются в буфер и сбрасываются одной транзакцией,
+    когда набирается batch_size ключей или проходит flush_interval секунд.
+    Несколько записей одного ключа между сбросами сериализуются один раз.
+    Чтения идут через LRU кэш на cache_size ключей.
+
+    Данные хранятся строкой на поле, а поля из split_fields - строкой на вложенный ключ,
+    поэтому update_data / update_fields пишут только изменённые поля.
+    """
+
+    def __init__(self, path: str = 'css_states.db',
+                 batch_size: int = 100,
+                 flush_interval: float = 0.05,
+                 cache_size: int = 10_000,
+                 split_fields: tuple[str, ...] = ('transmitted_data',),
+                 json_dumps: Callable[..., str] = json.dumps,
+                 json_loads: Callable[..., Any] = json.loads
+                 ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.split_fields = split_fields
+        self.json_dumps = json_dumps
+        self.json_loads = json_loads
+
+        # Все обращения к соединению идут из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='css-sqlite')
+        self._connection: Optional[sqlite3.Connection] = None
+
+        self._states: OrderedDict[str, Optional[str]] = OrderedDict()
+        self._data: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._dirty_states: set[str] = set()
+        # None - ключ перезаписывается целиком, иначе набор изменённых путей (field, [sub])
+        self._dirty_data: dict[str, Optional[set[tuple]]] = {}
+
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for query in _CREATE_TABLES:
+                connection.execute(query)
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _fetch(self, query: str, key: str) -> Any:
+        row = self._connect().execute(query, (key,)).fetchone()
+        return row[0] if row else None
+
+    def _write(self, states: list, ops: dict[str, list]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(_UPSERT_STATE, [i for i in states if i[1] is not None])
+            connection.executemany(_DELETE_STATE, [(i[0],) for i in states if i[1] is None])
+
+            # Сначала удаления, затем вставки - одна строка не может попасть в оба списка
+            connection.executemany(_DELETE_KEY_FIELDS, ops['delete_key'])
+            connection.executemany(_DELETE_FIELD, ops['delete_field'])
+            connection.executemany(_DELETE_SUBFIELD, ops['delete_subfield'])
+            connection.executemany(_UPSERT_FIELD, ops['upsert'])
+
+    def _load_data(self, key: str) -> list:
+        return self._connect().execute(_SELECT_FIELDS, (key,)).fetchall()
+
+    def _load_state_data(self, key: str) -> tuple[Optional[str], list]:
+        return self._fetch(_SELECT_STATE, key), self._load_data(key)
+
+    def _rows_from_db(self, rows: list) -> dict:
+        data = {}
+        for field, value in rows:
+            if _SEP in field:
+                field, sub = field.split(_SEP, 1)
+                data.setdefault(field, {})[sub] = self.json_loads(value)
+            else:
+                data[field] = self.json_loads(value)
+        return data
+
+    def _field_rows(self, key: str, field: str, value: Any) -> list[tuple]:
+        """ Строки базы для одного поля (поля из split_fields раскладываются по ключам)
+        """
+        if field in self.split_fields and isinstance(value, dict):
+            rows = [(key, field, '{}')]
+            for sub, sub_value in value.items():
+                rows.append((key, f'{field}{_SEP}{sub}',
+                             self.json_dumps(sub_value, default=json_default)))
+            return rows
+        return [(key, field, self.json_dumps(value, default=json_default))]
+
+    def _mark(self, key: str, paths: Optional[set[tuple]]) -> None:
+        if paths is None:
+            self._dirty_data[key] = None
+        elif key not in self._dirty_data:
+            self._dirty_data[key] = set(paths)
+        elif self._dirty_data[key] is not None:
+            self._dirty_data[key].update(paths)
+
+    def _remember(self, cache: OrderedDict, key: str, value: Any) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+
+        # Вытесняем только уже записанные в базу ключи
+        dirty = self._dirty_states if cache is self._states else self._dirty_data
+        while len(cache) > self.cache_size:
+            for old_key in cache:
+                if old_key not in dirty:
+                    del cache[old_key]
+                    break
+            else: break
+
+    def _schedule_flush(self) -> None:
+        if len(self._dirty_states) + len(self._dirty_data) >= self.batch_size:
+            if self._flush_handle:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._start_flush()
+
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _data_ops(self, key: str, data: dict, paths: Optional[set[tuple]], ops: dict) -> None:
+        """ Раскладывает изменения ключа на операции с базой
+        """
+        upsert, delete_field, delete_subfield = [], [], []
+
+        if paths is None:
+            for field, value in data.items():
+                upsert.extend(self._field_rows(key, field, value))
+        else:
+            for path in paths:
+                field = path[0]
+                if len(path) == 1:
+                    delete_field.append((key, field, field + _SEP, field + '\x20'))
+                    if field in data:
+                        upsert.extend(self._field_rows(key, field, data[field]))
+
+                elif isinstance(data.get(field), dict) and path[1] in data[field]:
+                    upsert.append((key, f'{field}{_SEP}{path[1]}',
+                                   self.json_dumps(data[field][path[1]], default=json_default)))
+                else:
+                    delete_subfield.append((key, f'{field}{_SEP}{path[1]}'))
+
+        # Ошибка сериализации не должна оставить ключ записанным наполовину
+        if paths is None:
+            ops['delete_key'].append((key,))
+        ops['delete_field'].extend(delete_field)
+        ops['delete_subfield'].extend(delete_subfield)
+        ops['upsert'].extend(upsert)
+
+    async def flush(self) -> None:
+        """ Записывает все накопленные изменения одной транзакцией
+        """
+        async with self._flush_lock:
+            states = [(key, self._states.get(key)) for key in self._dirty_states]
+            ops: dict[str, list] = {'delete_key': [], 'delete_field': [],
+                                    'delete_subfield': [], 'upsert': []}
+
+            for key, paths in self._dirty_data.items():
+                data = self._data.get(key, {})
+                try:
+                    self._data_ops(key, data, paths, ops)
+                except Exception as e:
+                    # Импорт здесь: interface.metrics импортирует bot.main, который создаёт хранилище
+                    from interface.metrics import metrics
+                    metrics.inc('css_errors_total', where='storage_serialization')
+                    print(f'SQLiteStorage serialization error {key} {e}')
+                    continue
+
+            self._dirty_states.clear()
+            self._dirty_data.clear()
+
+            if states or any(ops.values()):
+                await self._run(self._write, states, ops)
+
+        if self._dirty_states or self._dirty_data:
+            self._schedule_flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        str_key = key_to_str(key)
+        self._remember(self._states, str_key,
+                       state.state if isinstance(state, State) else state)
+        self._dirty_states.add(str_key)
+        self._schedule_flush()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        str_key = key_to_str(key)
+        state = self._states.get(str_key, _MISSING)
+
+        if state is _MISSING:
+            state = await self._run(self._fetch, _SELECT_STATE, str_key)
+            self._remember(self._states, str_key, state)
+        else: self._states.move_to_end(str_key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        str_key = key_to_str(key)
+        self._remember(self._data, str_key, data.copy())
+        self._mark(str_key, None)
+        self._schedule_flush()
+
+    async def _cached_data(self, str_key: str) -> dict:
+        data = self._data.get(str_key, _MISSING)
+
+        if data is _MISSING:
+            rows = await self._run(self._load_data, str_key)
+            data = self._rows_from_db(rows)
+            self._remember(self._data, str_key, data)
+        else: self._data.move_to_end(str_key)
+        return data
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._cached_data(key_to_str(key))).copy()
+
+    async def get_state_data(self, key: StorageKey) -> tuple[Optional[str], Dict[str, Any]]:
+        """ Состояние и данные за одно обращение: при промахе кэша - один заход в поток базы
+        """
+        str_key = key_to_str(key)
+        state = self._states.get(str_key, _MISSING)
+        data = self._data.get(str_key, _MISSING)
+
+        if state is _MISSING or data is _MISSING:
+            db_state, rows = await self._run(self._load_state_data, str_key)
+            if state is _MISSING:
+                state = db_state
+                self._remember(self._states, str_key, state)
+            if data is _MISSING:
+                data = self._rows_from_db(rows)
+                self._remember(self._data, str_key, data)
+        else:
+            self._states.move_to_end(str_key)
+            self._data.move_to_end(str_key)
+        return state, data.copy()
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        """ Обновление данных с записью только переданных полей
+        """
+        str_key = key_to_str(key)
+        current = (await self._cached_data(str_key)).copy()
+        current.update(data)
+
+        self._remember(self._data, str_key, current)
+        self._mark(str_key, {(field,) for field in data})
+        self._schedule_flush()
+        return current.copy()
+
+    async def update_fields(self, key: StorageKey, field: str,
+                            changes: Mapping[str, Any], deleted: list) -> None:
+        """ Обновление вложенных ключей поля field (дельта transmitted_data)
+        """
+        str_key = key_to_str(key)
+        current = (await self._cached_data(str_key)).copy()
+        value = current.get(field)
+        value = dict(value) if isinstance(value, dict) else {}
+
+        value.update(changes)
+        for sub in deleted:
+            value.pop(sub, None)
+        current[field] = value
+        self._remember(self._data, str_key, current)
+
+        if field in self.split_fields:
+            self._mark(str_key, {(field, sub) for sub in [*changes, *deleted]})
+        else:
+            self._mark(str_key, {(field,)})
+        self._schedule_flush()
+
+    async def set_plan(self, plan_id: str, steps: Union[bytes, list]) -> None:
+        """ Сохраняет план конвейера, чтобы он пережил перезапуск.
+            bytes (interface.codec) пишутся как есть, список шагов - json.
+        """
+        raw = steps if isinstance(steps, bytes) else self.json_dumps(steps, default=json_default)
+        await self._run(self._write_plan, plan_id, raw)
+
+    async def get_plan(self, plan_id: str) -> Union[bytes, list, None]:
+        raw = await self._run(self._fetch, _SELECT_PLAN, plan_id)
+        if isinstance(raw, bytes):
+            return raw
+        return self.json_loads(raw) if raw else None
+
+    def _write_plan(self, plan_id: str, raw: Union[bytes, str]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.execute(_INSERT_PLAN, (plan_id, raw))
+
+    async def close(self) -> None:
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task:
+            await self._flush_task
+        await self.flush()
+
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=True)
+
+
+class CSSMemoryStorage(MemoryStorage):
+    """ MemoryStorage с чтением состояния и данных за одно обращение
+    """
+
+    async def get_state_data(self, key: StorageKey) -> tuple[Optional[str], Dict[str, Any]]:
+        record = self.storage[key]
+        return record.state, record.data.copy()
+
+
+# Реестр хранилищ, выбирается при запуске (CSS_STORAGE)
+storage_registry: Dict[str, Type[BaseStorage]] = {
+    'memory': CSSMemoryStorage,
+    'sqlite': SQLiteStorage,
+}
+
+def create_storage(name: str = 'memory', **kwargs) -> BaseStorage:
+    """ Создаёт FSM хранилище по имени из storage_registry
+    """
+    storage_cls = storage_registry.get(name)
+    if not storage_cls:
+        raise ValueError(f"Storage '{name}' not found.")
+    return storage_cls(**kwargs)
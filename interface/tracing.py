@@ -0,0 +1,192 @@
+import atexit
+import json
+import time
+from contextvars import ContextVar
+from os import getenv
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from interface.metrics import metrics
+
+
+class UpdateTrace():
+    """ Замеры одного обновления: когда пришло, когда началась обработка,
+        сколько было запросов к API, и span-ы шагов, ответы на которые оно принесло
+    """
+
+    __slots__ = ('received_at', 'started_at', 'api_calls', 'spans')
+
+    def __init__(self, received_at: float):
+        self.received_at: float = received_at
+        self.started_at: float = received_at
+        self.api_calls: int = 0
+        self.spans: list[dict] = []
+
+
+current_update: ContextVar[Optional[UpdateTrace]] = ContextVar('css_update_trace', default=None)
+
+# Экспортёры span-ов: exporter(span: dict) -> None
+span_exporters: list[Callable[[dict], Any]] = []
+
+
+def tracing_enabled() -> bool:
+    return bool(span_exporters)
+
+def export_span(span: dict) -> None:
+    for exporter in span_exporters:
+        try:
+            exporter(span)
+        except Exception as e:
+            metrics.inc('css_errors_total', where='span_exporter')
+            print(f'Span exporter error {e}')
+
+def flush_spans() -> None:
+    for exporter in span_exporters:
+        flush = getattr(exporter, 'flush', None)
+        if flush:
+            flush()
+
+
+# Обновление (вызывается UserLockMiddleware)
+
+def begin_update() -> Optional[UpdateTrace]:
+    if not span_exporters:
+        return None
+    trace = UpdateTrace(time.time())
+    current_update.set(trace)
+    return trace
+
+def update_started(trace: UpdateTrace) -> None:
+    """ Блокировка пользователя получена - дальше обработка
+    """
+    trace.started_at = time.time()
+
+def end_update(trace: UpdateTrace) -> None:
+    finished = time.time()
+    for span in trace.spans:
+        span['processing_s'] = finished - span.pop('_at')
+        span['api_calls'] = trace.api_calls - span.pop('_api_calls')
+        export_span(span)
+    trace.spans.clear()
+
+def count_api_call() -> None:
+    trace = current_update.get()
+    if trace is not None:
+        trace.api_calls += 1
+
+
+# Конвейер (вызывается из next_step / ChooseStepHandler)
+
+def start_trace(transmitted_data: dict) -> None:
+    if span_exporters:
+        transmitted_data['trace'] = {'id': uuid4().hex, 'start': time.time()}
+
+def step_shown(transmitted_data: dict, step_state: dict) -> None:
+    """ Сообщение шага отправлено - с этого момента считается время пользователя
+    """
+    if 'trace' in transmitted_data:
+        step_state['shown_at'] = time.time()
+
+def step_answered(transmitted_data: dict, step: Any, process: int, step_state: dict) -> None:
+    """ Span шага: wait_s - ожидание блокировки/очереди, think_s - от сообщения до ответа,
+        processing_s и api_calls - от ответа до конца обработки обновления
+    """
+    trace_data = transmitted_data.get('trace')
+    if not trace_data or not span_exporters:
+        return
+
+    now = time.time()
+    span = {
+        'trace_id': trace_data['id'],
+        'kind': 'step',
+        'process': process,
+        'name': getattr(step, 'name', None),
+        'type': step.type,
+        'userid': transmitted_data.get('userid'),
+        'time': now,
+    }
+    shown_at = step_state.get('shown_at')
+
+    trace = current_update.get()
+    if trace is None:
+        # Ответ не из обновления (например, автоматический при запуске)
+        if shown_at:
+            span['think_s'] = now - shown_at
+        export_span(span)
+        return
+
+    first = not trace.spans
+    span['wait_s'] = trace.started_at - trace.received_at
+    if shown_at:
+        span['think_s'] = trace.received_at - shown_at
+    span['_at'] = trace.started_at if first else now
+    span['_api_calls'] = 0 if first else trace.api_calls
+    trace.spans.append(span)
+
+def update_step_done(transmitted_data: dict, step: Any, process: int, duration: float) -> None:
+    """ Span шага BaseUpdateType: время функции обновления
+    """
+    trace_data = transmitted_data.get('trace')
+    if not trace_data or not span_exporters:
+        return
+
+    export_span({
+        'trace_id': trace_data['id'],
+        'kind': 'update',
+        'process': process,
+        'function': step.function,
+        'userid': transmitted_data.get('userid'),
+        'time': time.time(),
+        'processing_s': duration,
+    })
+
+def end_trace(trace_data: Optional[dict], userid: Any, process: Any, outcome: str) -> None:
+    """ Span всего конвейера: finished / expired
+    """
+    if not trace_data or not span_exporters:
+        return
+
+    now = time.time()
+    export_span({
+        'trace_id': trace_data['id'],
+        'kind': 'conveyor',
+        'outcome': outcome,
+        'process': process,
+        'userid': userid,
+        'time': now,
+        'duration_s': now - trace_data['start'],
+    })
+
+
+class JsonLinesExporter():
+    """ Span-ы в файл, по одному JSON на строку.
+        Пишет пачками (flush_every span-ов или раз в flush_interval секунд).
+    """
+
+    def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 1.0):
+        self.path: str = path
+        self.flush_every: int = flush_every
+        self.flush_interval: float = flush_interval
+        self.buffer: list[str] = []
+        self.last_flush: float = time.monotonic()
+
+    def __call__(self, span: dict) -> None:
+        self.buffer.append(json.dumps(span, ensure_ascii=False, default=str))
+        if (len(self.buffer) >= self.flush_every
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        lines = '\n'.join(self.buffer) + '\n'
+        self.buffer.clear()
+        # Одна запись в режиме append - строки процессов sharded не перемешиваются
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+if getenv('CSS_TRACE_FILE'):
+    span_exporters.append(JsonLinesExporter(getenv('CSS_TRACE_FILE')))
+    atexit.register(flush_spans)
@@ -0,0 +1,99 @@
+from typing import Any, Hashable
+
+from aiogram.fsm.context import FSMContext
+
+
+_NOTHING = object()
+
+
+class TrackedDict(dict):
+    """
+    Словарь, запоминающий изменённые (dirty) и удалённые (deleted) ключи.
+    Используется для transmitted_data, чтобы писать в хранилище только изменения.
+    Вложенные изменения не отслеживаются - для них нужен mark(key).
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.dirty: set = set()
+        self.deleted: set = set()
+
+    def mark(self, key: Hashable) -> None:
+        """ Помечает ключ изменённым (например, после изменения вложенного словаря)
+        """
+        self.dirty.add(key)
+        self.deleted.discard(key)
+
+    def reset(self) -> None:
+        """ Сбрасывает изменения (данные уже записаны)
+        """
+        self.dirty.clear()
+        self.deleted.clear()
+
+    def changes(self) -> dict:
+        return {key: self[key] for key in self.dirty if key in self}
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        super().__setitem__(key, value)
+        self.mark(key)
+
+    def __delitem__(self, key: Hashable) -> None:
+        super().__delitem__(key)
+        self.dirty.discard(key)
+        self.deleted.add(key)
+
+    def pop(self, key: Hashable, default: Any = _NOTHING) -> Any:
+        if key in self:
+            value = super().pop(key)
+            self.dirty.discard(key)
+            self.deleted.add(key)
+            return value
+        if default is _NOTHING:
+            raise KeyError(key)
+        return default
+
+    def popitem(self) -> tuple:
+        key, value = super().popitem()
+        self.dirty.discard(key)
+        self.deleted.add(key)
+        return key, value
+
+    def setdefault(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self) -> None:
+        self.deleted.update(self.keys())
+        self.dirty.clear()
+        super().clear()
+
+
+async def save_changes(state: FSMContext, data: dict, field: str = 'transmitted_data') -> None:
+    """ Записывает в поле состояния field только изменённые ключи data.
+        Если data не TrackedDict, поле перезаписывается целиком.
+    """
+    if not isinstance(data, TrackedDict):
+        await state.update_data({field: data})
+        return
+
+    changes, deleted = data.changes(), list(data.deleted)
+    if not changes and not deleted:
+        return
+
+    storage = state.storage
+    if hasattr(storage, 'update_fields'):
+        await storage.update_fields(state.key, field, changes, deleted)
+    else:
+        current = await state.get_value(field)
+        value = dict(current) if isinstance(current, dict) else {}
+        value.update(changes)
+        for key in deleted:
+            value.pop(key, None)
+        await state.update_data({field: value})
+
+    data.reset()
@@ -1,6 +1,10 @@
 import importlib
 import asyncio
-from typing import Union
+import inspect
+import re
+from fractions import Fraction
+from functools import lru_cache
+from typing import Any, Callable, Optional, Union
 
 from bot.main import botik as bot
 from bot.main import STORAGE
@@ -52,18 +56,112 @@ def chunk_pages(options: dict,
     return pages
 
 
+class PagesView():
+    """ Ленивое представление страниц для режима page_view.
+        Ведёт себя как результат chunk_pages (len() и [page]),
+        но страница собирается из ключей options только при обращении к ней.
+
+        Если передан page, options содержит только эту страницу
+        (режим options_provider), а число страниц задаёт pages_count.
+    """
+
+    def __init__(self, options: dict, horizontal: int = 2, vertical: int = 3,
+                 page: Optional[int] = None, pages_count: int = 1):
+        self.options = options
+        self.horizontal = horizontal
+        self.vertical = vertical
+        self.page = page
+        self.pages_count = pages_count
+        # Ключи options списком: срез страницы - O(page_size), а не O(номер страницы * page_size)
+        self._keys: Optional[list] = None
+
+    @property
+    def page_size(self) -> int:
+        return self.horizontal * self.vertical
+
+    def __len__(self) -> int:
+        if self.page is not None:
+            return max(1, self.pages_count)
+        return max(1, -(-len(self.options) // self.page_size))
+
+    def __getitem__(self, page: int) -> list:
+        if page < 0: page += len(self)
+        if not 0 <= page < len(self):
+            raise IndexError('page index out of range')
+
+        if self.page is not None:
+            if page != self.page:
+                raise IndexError('only the loaded page is available')
+            start = 0
+        else: start = page * self.page_size
+
+        if self._keys is None:
+            self._keys = list(self.options)
+        keys = self._keys[start:start + self.page_size]
+        return filling_with_emptiness([chunks(keys, self.horizontal)],
+                                      self.horizontal, self.vertical)[0]
+
+    def __iter__(self):
+        for page in range(len(self)):
+            yield self[page]
+
+
+# Реестр функций обратного вызова: 'модуль.имя_функции' -> (функция, является ли корутиной)
+callbacks_registry: dict[str, tuple[Callable, bool]] = {}
+
+# Хуки для метрик, вызываются с путём функции, если её нет в реестре
+callback_miss_hooks: list[Callable[[str], Any]] = []
+
+def register_callback(func: Callable, func_path: Optional[str] = None) -> str:
+    """ Добавляет функцию в реестр, возвращает её путь.
+    """
+    func_path = func_path or f"{func.__module__}.{func.__name__}"
+    callbacks_registry[func_path] = (func, inspect.iscoroutinefunction(func))
+    return func_path
+
+def css_callback(func: Callable) -> Callable:
+    """ Декоратор, регистрирующий функцию обратного вызова заранее.
+    """
+    register_callback(func)
+    return func
+
 def func_to_str(func):
     """ Преобразует функцию в строку вида 'модуль.имя_функции'.
+        Функция сразу попадает в реестр.
     """
-    return f"{func.__module__}.{func.__name__}"
+    return register_callback(func)
+
+@lru_cache(maxsize=1024)
+def import_callback(func_path: str) -> tuple[Callable, bool]:
+    """ Импортирует функцию по строке вида 'модуль.имя_функции' (результат кэшируется).
+    """
+    module_name, func_name = func_path.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    func = getattr(module, func_name)
+    return func, inspect.iscoroutinefunction(func)
+
+def resolve_callback(func_path: str) -> tuple[Callable, bool]:
+    """ Возвращает функцию и признак корутины, сначала из реестра, затем импортом.
+    """
+    entry = callbacks_registry.get(func_path)
+    if entry is None:
+        for hook in callback_miss_hooks:
+            hook(func_path)
+        entry = import_callback(func_path)
+    return entry
 
 def str_to_func(func_path):
     """ Получает функцию по строке вида 'модуль.имя_функции'.
     """
+    return resolve_callback(func_path)[0]
 
-    module_name, func_name = func_path.rsplit('.', 1)
-    module = importlib.import_module(module_name)
-    return getattr(module, func_name)
+async def call_callback(func_path: str, *args, **kwargs) -> Any:
+    """ Вызывает функцию по строке, корутины ожидаются.
+    """
+    func, is_coroutine = resolve_callback(func_path)
+    if is_coroutine:
+        return await func(*args, **kwargs)
+    return func(*args, **kwargs)
 
 
 def list_to_keyboard(buttons: list[Union[list[str], str]], 
@@ -84,14 +182,29 @@ def list_to_keyboard(buttons: list[Union[list[str], str]],
         >  привет
           отвяжись  
           ты кто?
+
+        Клавиатуры кэшируются по содержимому, возвращаемый объект общий - не изменяйте его.
+    """
+    rows = tuple(
+        tuple(line) if type(line) == list else (str(line),)
+        for line in buttons
+    )
+    try:
+        return reply_keyboard(rows, row_width, resize_keyboard, one_time_keyboard)
+    except TypeError: # Нехэшируемые кнопки собираем без кэша
+        return reply_keyboard.__wrapped__(rows, row_width, resize_keyboard, one_time_keyboard)
+
+@lru_cache(maxsize=512)
+def reply_keyboard(rows: tuple, row_width: int = 3,
+                   resize_keyboard: bool = True,
+                   one_time_keyboard = None
+                   ) -> ReplyKeyboardMarkup:
+    """ Собирает клавиатуру из строк с текстами кнопок (результат кэшируется)
     """
     builder = ReplyKeyboardBuilder()
 
-    for line in buttons:
-        if type(line) == list:
-            builder.row(*[KeyboardButton(text=i) for i in line], width=row_width)
-        else:
-            builder.row(*[KeyboardButton(text=str(line))], width=row_width)
+    for line in rows:
+        builder.row(*[KeyboardButton(text=i) for i in line], width=row_width)
 
     return builder.as_markup(row_width=row_width, resize_keyboard=resize_keyboard, one_time_keyboard=one_time_keyboard)
 
@@ -110,6 +223,14 @@ def down_menu(markup: ReplyKeyboardMarkup,
               ): 
     """Добавления нижнего меню для страничных клавиатур
     """
+    # Клавиатура только из текстовых кнопок собирается из кэша по текстам
+    rows = []
+    for line in markup.keyboard:
+        if any(button.model_fields_set - {'text'} for button in line):
+            break
+        rows.append(tuple(button.text for button in line))
+    else:
+        return paged_keyboard(tuple(rows), arrows, cancel_button, back_button, forward_button)
 
     markup_n = ReplyKeyboardBuilder().from_markup(markup)
 
@@ -122,6 +243,27 @@ def down_menu(markup: ReplyKeyboardMarkup,
 
     return markup_n.as_markup(resize_keyboard=True)
 
+@lru_cache(maxsize=512)
+def paged_keyboard(rows: tuple,
+                   arrows: bool = True,
+                   cancel_button: str = CANCEL_BUTTON,
+                   back_button: str = BACK_BUTTON,
+                   forward_button: str = FORWARD_BUTTON,
+                   ) -> ReplyKeyboardMarkup:
+    """ Клавиатура страницы с нижним меню по текстам кнопок (результат кэшируется)
+    """
+    markup_n = ReplyKeyboardBuilder(
+        markup=[[KeyboardButton(text=i) for i in line] for line in rows])
+
+    if arrows:
+        markup_n.row(*[KeyboardButton(text=i) for i in [
+            back_button, cancel_button, forward_button]]
+                     )
+    else: 
+        markup_n.row(KeyboardButton(text=cancel_button))
+
+    return markup_n.as_markup(resize_keyboard=True)
+
 
 async def async_open(file_path: str, 
                      mode: str = 'r', 
@@ -132,28 +274,57 @@ async def async_open(file_path: str,
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(None, open, file_path, mode, encoding)
 
+# Единицы времени от большей к меньшей
+time_units: tuple[tuple[str, int], ...] = (
+    ('year', 31_536_000),
+    ('month', 2_592_000), ('weekly', 604800),
+    ('day', 86400), ('hour', 3600),
+    ('minute', 60), ('second', 1)
+)
+
+# Формы слова: (1, 2-4, 5-20, сокращение)
+time_names: dict[str, dict[str, tuple[str, str, str, str]]] = {
+    'ru': {
+        'year': ('год', 'года', 'лет', 'г.'),
+        'month': ('месяц', 'месяца', 'месяцев', 'мес.'),
+        'weekly': ('неделя', 'недели', 'недель', 'нед.'),
+        'day': ('день', 'дня', 'дней', 'д.'),
+        'hour': ('час', 'часа', 'часов', 'ч.'),
+        'minute': ('минута', 'минуты', 'минут', 'мин.'),
+        'second': ('секунда', 'секунды', 'секунд', 'сек.')
+    },
+    'en': {
+        'year': ('year', 'years', 'years', 'y.'),
+        'month': ('month', 'months', 'months', 'mo.'),
+        'weekly': ('week', 'weeks', 'weeks', 'wk.'),
+        'day': ('day', 'days', 'days', 'd.'),
+        'hour': ('hour', 'hours', 'hours', 'h.'),
+        'minute': ('minute', 'minutes', 'minutes', 'min.'),
+        'second': ('second', 'seconds', 'seconds', 'sec.')
+    }
+}
+
+def _ru_plural(number: int) -> int:
+    if 11 <= number % 100 <= 14: return 2
+    if number % 10 == 1: return 0
+    if 2 <= number % 10 <= 4: return 1
+    return 2
+
+def _en_plural(number: int) -> int:
+    return 0 if number == 1 else 2
+
+# Индекс формы слова по number % 100; языки без таблицы - по _en_plural
+plural_forms: dict[str, tuple[int, ...]] = {
+    'ru': tuple(_ru_plural(i) for i in range(100)),
+}
+
 def seconds_to_time(seconds: int) -> dict:
     """ Преобразует число в словарь
     """
-    time_calculation = {
-        'year': 31_536_000,
-        'month': 2_592_000, 'weekly': 604800,
-        'day': 86400, 'hour': 3600, 
-        'minute': 60, 'second': 1
-    }
-    time_dict = {
-        'year': 0,
-        'month': 0, 'weekly': 0,
-        'day': 0, 'hour': 0, 
-        'minute': 0, 'second': 0
-    }
+    time_dict = {}
 
-    for tp, unit in time_calculation.items():
-        tt = seconds // unit
-
-        if tt:
-            seconds -= tt * unit
-            time_dict[tp] = tt
+    for tp, unit in time_units:
+        time_dict[tp], seconds = divmod(seconds, unit)
 
     return time_dict 
 
@@ -161,10 +332,10 @@ def seconds_to_str(seconds: int, lang: str='en', mini: bool=False, max_lvl='auto
     """ Преобразует число секунд в строку
        Example:
        > seconds=10000 lang='ru'
-       > 1 день 2 минуты 41 секунда
+       > 2 часа 46 минут 40 секунд
        
        > seconds=10000 lang='ru' mini=True
-       > 1д. 2мин. 41сек.
+       > 2ч. 46мин. 40сек.
        
        max_lvl - Определяет максимальную глубину погружения
        Example:
@@ -173,92 +344,84 @@ def seconds_to_str(seconds: int, lang: str='en', mini: bool=False, max_lvl='auto
        
        > seconds=3900 max_lvl=hour
        > 1ч.
+
+       По умолчанию (auto) выводятся 3 старшие ненулевые единицы.
+       Языки - time_names, для остальных используется русский.
     """
     if seconds == 'inf': return "♾"
     if seconds < 0: seconds = 0
 
-    time_format = {
-        'year': ['год', 'года', 'лет', 'г.'],
-        'month': ['месяц', 'месяца', 'месяцев', 'мес.'],
-        'weekly': ['неделя', 'недели', 'недель', 'нед.'],
-        'day': ['день', 'дня', 'дней', 'д.'],
-        'hour': ['час', 'часа', 'часов', 'ч.'],
-        'minute': ['минута', 'минуты', 'минут', 'мин.'],
-        'second': ['секунда', 'секунды', 'секунд', 'сек.']
-    }
-    result = ''
-
-    def ending_w(time_type: str, unit: int) -> str:
-        """Опредеяет окончание для слова
-        """
-        if mini: return time_format[time_type][3]
+    names = time_names.get(lang)
+    if names is None:
+        lang, names = 'ru', time_names['ru']
+    forms = plural_forms.get(lang)
 
-        else:
-            result = ''
-            if unit < 11 or unit > 14:
-                unit = unit % 10
-
-            if unit == 1:
-                result = time_format[time_type][0]
-            elif unit > 1 and unit <= 4:
-                result = time_format[time_type][1]
-            elif unit > 4 or unit == 0:
-                result = time_format[time_type][2]
-        return result
-
-    data = seconds_to_time(seconds=seconds)
-    if max_lvl == 'auto':
-        max_lvl, a, lst_n = 'second', 0, 'second'
-
-        for tp, unit in data.items():
-            if unit: 
-                a += 1
-                lst_n = tp
-            if a >= 3:
-                max_lvl = tp
-                break
-
-        if a < 3: max_lvl = lst_n
-
-    for tp, unit in data.items():
-        if unit:
+    parts = []
+    for tp, unit in time_units:
+        value, seconds = divmod(seconds, unit)
+        if value:
             if mini:
-                result += f'{unit}{ending_w(tp, unit)} '
+                parts.append(f'{value}{names[tp][3]}')
             else:
-                result += f'{unit} {ending_w(tp, unit)} '
+                form = forms[value % 100] if forms else _en_plural(value)
+                parts.append(f'{value} {names[tp][form]}')
+
+            if max_lvl == 'auto' and len(parts) >= 3: break
         if max_lvl == tp: break
 
-    if result[:-1]: return result[:-1]
-    else: 
-        result = '0'
-        if max_lvl != 'second': 
-            return f'0 {time_format[max_lvl][3]}'
-        return result
+    if parts: return ' '.join(parts)
+    if max_lvl in ('auto', 'second'): return '0'
+    return f'0 {names[max_lvl][3]}'
 
 
-def str_to_seconds(text: str):
-    """ Преобразует текст в секнудны
-    """
-    words = text.split()
-    seconds = 0
+# Множители суффиксов времени
+time_suffixes: dict[str, int] = {
+    '': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 86400 * 7
+}
+# Часть слова "число[суффикс]": 30, 10m, 1.5h (слово 1h30m - две части подряд).
+# Слово проверяется проходом по частям, а не одним выражением с вложенным повтором -
+# оно откатывается экспоненциально на длинных неподходящих словах
+_time_part = re.compile(r'(\d+(?:[.,]\d+)?)([smhdw]?)', re.IGNORECASE)
 
-    for i in words:
-        mn = 1
-        if len(i) == 1 and i.isdigit(): seconds += int(i)
+def _time_word_seconds(word: str) -> Optional[Union[int, Fraction]]:
+    """ Секунды слова из частей "число[суффикс]" или None, если слово не такое.
+        Дробные части - Fraction: float переполняется (inf) на длинных числах
+    """
+    seconds, pos = 0, 0
+    for part in _time_part.finditer(word):
+        if part.start() != pos:
+            return None
+        pos = part.end()
+
+        number, suffix = part.groups()
+        multiplier = time_suffixes[suffix.lower()]
+        if '.' in number or ',' in number:
+            seconds += Fraction(number.replace(',', '.')) * multiplier
+        else:
+            seconds += int(number) * multiplier
+    return seconds if pos == len(word) else None
 
-        if len(i) > 1:
-            if type(i[-1]) == str:
-                number = i[:-1]
+def str_to_seconds(text: str) -> int:
+    """ Преобразует текст в секунды: "90", "10m", "1h 30m", "1h30m", "1.5h", "2,5d".
+        Слова, не похожие на время, пропускаются.
+    """
+    if text.isdecimal(): return int(text)
 
-                if number.isdigit():
-                    if i[:-1] == 's': mn = 1
-                    elif i[-1] == 'm': mn = 60
-                    elif i[-1] == 'h': mn = 3600
-                    elif i[-1] == 'd': mn = 86400
-                    elif i[-1] == 'w': mn = 86400 * 7
+    seconds = 0
+    for word in text.split():
+        # Частые случаи без регулярного выражения: "90", "10m"
+        if word.isdecimal():
+            seconds += int(word)
+            continue
+        multiplier = time_suffixes.get(word[-1].lower())
+        if multiplier and word[:-1].isdecimal():
+            seconds += int(word[:-1]) * multiplier
+            continue
 
-                    seconds += int(number) * mn
-    return seconds
+        word_seconds = _time_word_seconds(word)
+        if word_seconds is not None:
+            seconds += word_seconds
+    return int(round(seconds))
 
 
 def list_to_inline(buttons, row_width=3):
@@ -269,21 +432,33 @@ def list_to_inline(buttons, row_width=3):
                           {'text': 'Кнопка 3', 'callback_data': 'btn3'} ]
               
               > Кнопка 1 | Кнопка 2 | Кнопка 3
-    """
 
-    inline_keyboard = []
+         Клавиатуры кэшируются по содержимому, возвращаемый объект общий - не изменяйте его.
+    """
+    key = tuple(tuple(button.items()) for button in buttons)
+    try:
+        return inline_keyboard(key, row_width)
+    except TypeError: # Нехэшируемые значения собираем без кэша
+        return inline_keyboard.__wrapped__(key, row_width)
+
+@lru_cache(maxsize=512)
+def inline_keyboard(buttons: tuple, row_width: int = 3) -> InlineKeyboardMarkup:
+    """ Собирает inline-клавиатуру из кортежей пар кнопок (результат кэшируется)
+    """
+    keyboard = []
     row = []
-    for button in buttons:
+    for items in buttons:
+        button = dict(items)
 
         if 'ignore_row' in button and button['ignore_row'].lower() == 'true':
-            inline_keyboard.append(row)
+            keyboard.append(row)
             row = []
-            inline_keyboard.append([InlineKeyboardButton(**button)])
+            keyboard.append([InlineKeyboardButton(**button)])
             continue
         row.append(InlineKeyboardButton(**button))
         if len(row) == row_width:
-            inline_keyboard.append(row)
+            keyboard.append(row)
             row = []
     if row:
-        inline_keyboard.append(row)
-    return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
\ No newline at end of file
+        keyboard.append(row)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,196 @@
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message
+
+from interface.conveyor import set_step_value
+from interface.option_index import match_option
+from interface.scheduler import scheduled_bot as bot
+from interface.utils import call_callback, seconds_to_str, str_to_seconds
+
+
+# Значение не разобрано - ответ с ошибкой уже отправлен
+INVALID = object()
+
+# Проверка: check(value, data) -> текст ошибки или None
+Check = Callable[[Any, dict], Optional[str]]
+
+
+class InputPipeline():
+    """
+    Скомпилированная проверка ввода: parse(text, data) -> значение или INVALID,
+    затем проверки по порядку. Собирается один раз на тип обработчика и параметры
+    (compile_pipeline), тексты ошибок без подстановок подготовлены заранее.
+    """
+
+    __slots__ = ('parse', 'checks', 'invalid_text')
+
+    def __init__(self, parse: Callable[[str, dict], Any],
+                 checks: tuple[Check, ...] = (),
+                 invalid_text: str = "❗ Пожалуйста, выберите один из предложенных вариантов."):
+        self.parse = parse
+        self.checks = checks
+        self.invalid_text: str = invalid_text
+
+    def check(self, value: Any, data: dict) -> Optional[str]:
+        for check in self.checks:
+            error = check(value, data)
+            if error:
+                return error
+        return None
+
+
+# int
+
+def parse_int(text: str, data: dict) -> Any:
+    number = INVALID
+    for word in text.split():
+        if word.isdecimal():
+            number = int(word)
+    return number
+
+def int_pipeline(min_int: int, max_int: int) -> InputPipeline:
+    checks = []
+    if max_int != 0:
+        too_big = '❗ Введённое число слишком большое. Максимально допустимое: {max}.'.format(max=max_int)
+        checks.append(lambda value, data: too_big if value > max_int else None)
+    too_small = '❗ Введённое число слишком маленькое. Минимально допустимое: {min}.'.format(min=min_int)
+    checks.append(lambda value, data: too_small if value < min_int else None)
+
+    return InputPipeline(parse_int, tuple(checks), '❗ Пожалуйста, введите число.')
+
+
+# str
+
+def parse_str(text: str, data: dict) -> str:
+    return text
+
+def str_pipeline(min_len: int, max_len: int) -> InputPipeline:
+    checks = []
+    if max_len != 0:
+        checks.append(lambda value, data: (
+            "❗ Пожалуйста, не превышайте максимальную длину сообщения. Максимальная длина: {max} символов, "
+            "ваше сообщение содержит: {number} символов.".format(number=len(value), max=max_len)
+        ) if len(value) > max_len else None)
+    checks.append(lambda value, data: (
+        "❗ Пожалуйста, не менее {min} символов. Ваше сообщение содержит: {number} символов.".format(
+            number=len(value), min=min_len)
+    ) if len(value) < min_len else None)
+
+    return InputPipeline(parse_str, tuple(checks))
+
+
+# time (тексты ошибок на русском - единицы времени в них тоже)
+
+def parse_time(text: str, data: dict) -> int:
+    return str_to_seconds(text)
+
+def time_pipeline(min_int: int, max_int: int) -> InputPipeline:
+    invalid = "❗ Пожалуйста, введите корректное время."
+    checks = []
+    if min_int != 0:
+        checks.append(lambda value, data: invalid if not value else None)
+    if max_int != 0:
+        max_str = seconds_to_str(max_int, 'ru')
+        checks.append(lambda value, data: (
+            f"❗ Время {seconds_to_str(value, 'ru')} превышает максимальное значение {max_str}"
+        ) if value > max_int else None)
+    min_str = seconds_to_str(min_int, 'ru')
+    checks.append(lambda value, data: (
+        f"❗ Время {seconds_to_str(value, 'ru')} меньше минимального значения {min_str}"
+    ) if value < min_int else None)
+
+    return InputPipeline(parse_time, tuple(checks), invalid)
+
+
+# bool
+
+confirm_buttons: dict[str, bool] = {
+    "Включить": True,
+    "Подтвердить": True,
+    "Отключить": False,
+    "Да": True,
+    "Нет": False,
+    'true': True,
+    'false': False,
+}
+
+def parse_confirm(text: str, data: dict) -> Any:
+    return confirm_buttons.get(text, INVALID)
+
+def confirm_pipeline() -> InputPipeline:
+    return InputPipeline(parse_confirm)
+
+
+# option (варианты свои у каждого шага - берутся из данных состояния,
+# текст сопоставляется через индекс interface/option_index.py)
+
+def parse_option(text: str, data: dict) -> Any:
+    options = data['options']
+    key = match_option(options, text, data.get('match_prefix', False), data.get('options_id'))
+    return INVALID if key is None else options[key]
+
+def option_pipeline() -> InputPipeline:
+    return InputPipeline(parse_option)
+
+
+# Тип обработчика (indenf) -> (сборщик, ключи данных состояния с его параметрами)
+pipeline_builders: dict[str, tuple[Callable[..., InputPipeline], tuple[str, ...]]] = {
+    'int': (int_pipeline, ('min_int', 'max_int')),
+    'string': (str_pipeline, ('min_len', 'max_len')),
+    'time': (time_pipeline, ('min_int', 'max_int')),
+    'confirm': (confirm_pipeline, ()),
+    'option': (option_pipeline, ()),
+}
+
+@lru_cache(maxsize=1024)
+def compile_pipeline(kind: str, params: tuple) -> InputPipeline:
+    """ Проверка для типа обработчика с параметрами (результат кэшируется)
+    """
+    builder = pipeline_builders[kind][0]
+    return builder(*params)
+
+
+async def send_error(message: Message, text: str) -> None:
+    """ Общий ответ на неверный ввод
+    """
+    await bot.send_message(message.chat.id, text)
+
+async def validate_input(message: Message, data: dict, kind: str) -> Any:
+    """
+    Разбирает и проверяет текст сообщения для обработчика kind.
+    После встроенных проверок вызываются validators из данных состояния:
+    validator(value, transmitted_data) -> текст ошибки или None.
+    Возвращает значение или INVALID (ошибка уже отправлена пользователю).
+    """
+    if not data:
+        return INVALID
+
+    keys = pipeline_builders[kind][1]
+    pipeline = compile_pipeline(kind, tuple([data[i] for i in keys]) if keys else ())
+
+    value = pipeline.parse(message.text or '', data)
+    if value is INVALID:
+        error = pipeline.invalid_text
+    else:
+        error = pipeline.check(value, data)
+
+    if error is None and data.get('validators'):
+        for validator in data['validators']:
+            error = await call_callback(validator, value, data['transmitted_data'])
+            if error:
+                break
+
+    if error:
+        await send_error(message, error)
+        return INVALID
+    return value
+
+async def finish_input(message: Message, state: FSMContext, handler: Any, value: Any) -> None:
+    """ Общее завершение ввода: id сообщения пользователя, очистка состояния, вызов функции
+    """
+    set_step_value(handler.transmitted_data, 'umessageid', message.message_id)
+
+    await handler.leave_state(state)
+    await handler.call_function(value)
@@ -1,4 +1,13 @@
-from bot.main import run
+from os import getenv
+
+from bot.main import run, run_webhook
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    mode = getenv('CSS_MODE', 'polling')
+    if mode == 'webhook':
+        run_webhook()
+    elif mode == 'sharded':
+        from bot.sharded import run_sharded
+        run_sharded(int(getenv('CSS_WORKERS', 2)))
+    else:
+        run()
\ No newline at end of file
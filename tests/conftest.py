@@ -0,0 +1,4 @@
+import os
+
+# bot.main создаёт Bot при импорте - токен нужен только для валидации формата
+os.environ.setdefault('BOT_TOKEN', '42:TEST')
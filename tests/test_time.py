@@ -0,0 +1,59 @@
+""" str_to_seconds / seconds_to_str: совпадение с прежними реализациями
+    на случайных входах (там, где прежние работали верно) и новое поведение.
+"""
+import random
+import time
+
+import pytest
+
+from benchmarks.time_parse import (
+    legacy_seconds_to_str, legacy_str_to_seconds, levels, random_seconds, random_time_text
+)
+from interface.utils import seconds_to_str, str_to_seconds
+
+
+CASES = 20_000
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_seconds_to_str_matches_legacy(seed):
+    rnd = random.Random(seed)
+    for _ in range(CASES):
+        seconds = random_seconds(rnd)
+        mini = rnd.random() < 0.5
+        max_lvl = rnd.choice(levels)
+        assert seconds_to_str(seconds, 'ru', mini, max_lvl) == \
+            legacy_seconds_to_str(seconds, 'ru', mini, max_lvl), (seconds, mini, max_lvl)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_str_to_seconds_matches_legacy(seed):
+    rnd = random.Random(seed)
+    for _ in range(CASES):
+        text = random_time_text(rnd)
+        assert str_to_seconds(text) == legacy_str_to_seconds(text), text
+
+
+@pytest.mark.parametrize('text, seconds', [
+    ('90', 90), ('1h30m', 5400), ('1h 30m', 5400), ('1.5h', 5400), ('2,5m', 150),
+    ('10s', 10), ('1H', 3600), ('abc', 0), ('10x', 0), ('', 0),
+])
+def test_str_to_seconds(text, seconds):
+    assert str_to_seconds(text) == seconds
+
+@pytest.mark.parametrize('text', ['1' * 26 + 'x', '1h' * 5000 + 'x', '1.1' * 5000 + '.'])
+def test_str_to_seconds_linear(text):
+    # Раньше - экспоненциальный откат регулярного выражения
+    start = time.perf_counter()
+    assert str_to_seconds(text) == 0
+    assert time.perf_counter() - start < 0.1
+
+@pytest.mark.parametrize('text', ['9' * 400 + '.5h', '9' * 400 + ' 1.5h', '1.' + '9' * 400 + 'w'])
+def test_str_to_seconds_long_numbers(text):
+    # float переполнялся до inf, int(round(inf)) - OverflowError
+    assert str_to_seconds(text) > 0
+
+
+def test_seconds_to_str_forms():
+    assert seconds_to_str(111 * 31_536_000, 'ru') == '111 лет'
+    assert seconds_to_str(3660, 'en') == '1 hour 1 minute'
+    assert seconds_to_str(3660, 'xx') == seconds_to_str(3660, 'ru')